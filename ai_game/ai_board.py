@@ -1,33 +1,183 @@
 from ai_game.ai_pieces import Piece, PieceType
+from ai_game.zobrist import PIECE_KEYS
+from ai_game.state_encoding import PIECE_CODES
+
+COLORS = ("white", "black")
+
+# Squares are numbered row * 8 + col, so bit n of a mask is square n
+SQUARE_MASKS = [1 << square for square in range(64)]
+
+
+def _adjacent_mask(square):
+    row, col = divmod(square, 8)
+    mask = 0
+    for adj_row, adj_col in [(row-1, col), (row+1, col), (row, col-1), (row, col+1)]:
+        if 0 <= adj_row < 8 and 0 <= adj_col < 8:
+            mask |= SQUARE_MASKS[adj_row * 8 + adj_col]
+    return mask
+
+
+def _diagonal_ray(square, row_step, col_step):
+    row, col = divmod(square, 8)
+    mask = 0
+    row, col = row + row_step, col + col_step
+    while 0 <= row < 8 and 0 <= col < 8:
+        mask |= SQUARE_MASKS[row * 8 + col]
+        row, col = row + row_step, col + col_step
+    return mask
+
+
+ADJACENT_MASKS = [_adjacent_mask(square) for square in range(64)]
+
+# Turrets fire along these. The first two rays run towards lower square numbers,
+# so their nearest blocker is the highest set bit, the last two the lowest.
+DIAGONAL_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+DIAGONAL_RAYS = [[_diagonal_ray(square, row_step, col_step) for row_step, col_step in DIAGONAL_DIRECTIONS]
+                 for square in range(64)]
+FULL_MASK = (1 << 64) - 1
+FIRST_COLUMN_MASK = sum(SQUARE_MASKS[row * 8] for row in range(8))
+LAST_COLUMN_MASK = sum(SQUARE_MASKS[row * 8 + 7] for row in range(8))
+CENTER_MASK = SQUARE_MASKS[27] | SQUARE_MASKS[28] | SQUARE_MASKS[35] | SQUARE_MASKS[36]
+
+
+def neighbours_mask(mask):
+    """Every square orthogonally next to a square in the mask"""
+    return ((mask << 8) | (mask >> 8) | ((mask & ~LAST_COLUMN_MASK) << 1) | ((mask & ~FIRST_COLUMN_MASK) >> 1)) & FULL_MASK
+
+
+def iter_squares(mask):
+    """Yields the (row, col) of every set bit in a mask, lowest square first"""
+    while mask:
+        low_bit = mask & -mask
+        yield divmod(low_bit.bit_length() - 1, 8)
+        mask ^= low_bit
+
+
+class _BoardRow:
+    """One row of the board view, reads and writes go through the bitboards"""
+    def __init__(self, board, row):
+        self._board = board
+        self._row = row
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return self._board.squares[self._row * 8:self._row * 8 + 8][col]
+        if col < 0:
+            col += 8
+        if not 0 <= col < 8:
+            raise IndexError("board column out of range")
+        return self._board.squares[self._row * 8 + col]
+
+    def __setitem__(self, col, piece):
+        if col < 0:
+            col += 8
+        if not 0 <= col < 8:
+            raise IndexError("board column out of range")
+        self._board.set_piece_at(self._row, col, piece)
+
+    def __iter__(self):
+        return iter(self._board.squares[self._row * 8:self._row * 8 + 8])
+
+    def __len__(self):
+        return 8
+
+
+class _BoardView:
+    """Keeps the old board.board[row][col] access working for the UI"""
+    def __init__(self, board):
+        self._rows = [_BoardRow(board, row) for row in range(8)]
+
+    def __getitem__(self, row):
+        return self._rows[row]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return 8
+
 
 class Board:
     def __init__(self):
-        self.board = [[None for num in range(8)] for num in range(8)]
+        # One 64-bit mask per color and piece type, plus a per-color union
+        self.bitboards = {color: {piece_type: 0 for piece_type in PieceType} for color in COLORS}
+        self.occupied = {color: 0 for color in COLORS}
+        self.squares = [None] * 64  # Piece objects, only used to hand pieces back out
+        self.board = _BoardView(self)
         self.king_positions = {"white": None, "black": None}
+        self.journal = None  # When a list, every square change is logged to it as (row, col, old piece)
+        self.zobrist = 0  # Hash of the pieces on the board, see ai_game.zobrist
+        self.packed = 0  # Four bits per square, see ai_game.state_encoding
 
     def get_piece_at(self, row, col):
         if 0 <= row < 8 and 0 <= col < 8:
-            return self.board[row][col]
+            return self.squares[row * 8 + col]
         else:
             return None
 
+    def set_piece_at(self, row, col, piece):
+        """Puts a piece (or None) on a square, replacing whatever was there"""
+        if self.journal is not None:
+            self.journal.append((row, col, self.squares[row * 8 + col]))
+        self._clear_square(row, col)
+        if piece is not None:
+            self._put_piece(row, col, piece)
+
+    def remove_piece(self, row, col):
+        """Clears a square and returns the piece that was on it"""
+        if self.journal is not None and self.squares[row * 8 + col] is not None:
+            self.journal.append((row, col, self.squares[row * 8 + col]))
+        return self._clear_square(row, col)
+
+    def undo_journal(self, journal):
+        """Puts back every square change in a journal, newest first"""
+        for row, col, piece in reversed(journal):
+            self._clear_square(row, col)
+            if piece is not None:
+                self._put_piece(row, col, piece)
+
+    def _put_piece(self, row, col, piece):
+        square = row * 8 + col
+        bit = SQUARE_MASKS[square]
+        self.squares[square] = piece
+        self.bitboards[piece.color][piece.piece_type] |= bit
+        self.occupied[piece.color] |= bit
+        self.zobrist ^= PIECE_KEYS[piece.color][piece.piece_type][square]
+        self.packed ^= PIECE_CODES[(piece.color, piece.piece_type)] << (4 * square)
+        piece.position = (row, col)
+        if piece.piece_type == PieceType.KING:
+            self.king_positions[piece.color] = (row, col)
+
+    def _clear_square(self, row, col):
+        square = row * 8 + col
+        piece = self.squares[square]
+        if piece is None:
+            return None
+        bit = SQUARE_MASKS[square]
+        self.squares[square] = None
+        self.bitboards[piece.color][piece.piece_type] &= ~bit
+        self.occupied[piece.color] &= ~bit
+        self.zobrist ^= PIECE_KEYS[piece.color][piece.piece_type][square]
+        self.packed ^= PIECE_CODES[(piece.color, piece.piece_type)] << (4 * square)
+        if piece.piece_type == PieceType.KING:
+            self.king_positions[piece.color] = None
+        return piece
+
     def place_piece(self, row, col, piece_type, color):
-        if self.is_valid_position(row, col) and self.board[row][col] is None:
-            newpiece = Piece(color, piece_type)
-            self.board[row][col] = newpiece
-            newpiece.position = (row, col)
-            if piece_type == PieceType.KING:
-                self.king_positions[color] = (row, col)
+        if self.is_valid_position(row, col) and self.squares[row * 8 + col] is None:
+            self.set_piece_at(row, col, Piece(color, piece_type))
             return True
         return False
 
+    def all_occupied(self):
+        return self.occupied["white"] | self.occupied["black"]
+
     def is_valid_position(self, row, col):
         return 0 <= row < 8 and 0 <= col < 8
 
     def is_valid_initial_placement(self, row, col):
         # King can't be placed in the center 4 squares
-        center_squares = [(3, 3), (3, 4), (4, 3), (4, 4)]
-        return (row, col) not in center_squares
+        return not (self.is_valid_position(row, col) and CENTER_MASK & SQUARE_MASKS[row * 8 + col])
 
     def is_adjacent_to_king(self, row, col, color):
         king_pos = self.king_positions[color]
@@ -36,49 +186,100 @@ class Board:
         return (row, col) in adjacent_positions
 
     def is_adjacent_to_piece(self, row, col, color):
-        adjacent_positions = [
-            (row-1, col), (row+1, col), (row, col-1), (row, col+1)
-        ]
-        for adj_row, adj_col in adjacent_positions:
-            if self.is_valid_position(adj_row, adj_col):
-                piece = self.get_piece_at(adj_row, adj_col)
-                if piece and piece.color == color:
-                    return True
-        return False
+        if not self.is_valid_position(row, col):
+            return False
+        return bool(ADJACENT_MASKS[row * 8 + col] & self.occupied[color])
+
+    def pawn_placement_mask(self, color):
+        """Empty squares connected to the player's island"""
+        return neighbours_mask(self.occupied[color]) & ~self.all_occupied()
+
+    def first_piece_on_ray(self, square, direction):
+        """Square of the nearest piece along one diagonal, or None if the ray is clear"""
+        blockers = DIAGONAL_RAYS[square][direction] & self.all_occupied()
+        if not blockers:
+            return None
+        if direction < 2:
+            return blockers.bit_length() - 1
+        return (blockers & -blockers).bit_length() - 1
+
+    def turret_targets(self, row, col, color):
+        """Enemy pieces a turret of this color on (row, col) can see"""
+        square = row * 8 + col
+        enemy = self.occupied["black" if color == "white" else "white"]
+        targets = []
+        for direction in range(4):
+            target = self.first_piece_on_ray(square, direction)
+            if target is not None and enemy & SQUARE_MASKS[target]:
+                targets.append(divmod(target, 8))
+        return targets
+
+    def turret_attack_map(self, color):
+        """Every turret of the color that has a shot, mapped to its targets"""
+        attack_map = {}
+        for row, col in iter_squares(self.bitboards[color][PieceType.TURRET]):
+            targets = self.turret_targets(row, col, color)
+            if targets:
+                attack_map[(row, col)] = targets
+        return attack_map
+
+    def threat_mask(self, color):
+        """Mask of the enemy squares the color's turrets currently threaten"""
+        mask = 0
+        for targets in self.turret_attack_map(color).values():
+            for row, col in targets:
+                mask |= SQUARE_MASKS[row * 8 + col]
+        return mask
+
+    def connected_mask(self, row, col):
+        """Mask of the island containing (row, col), grown a whole ring of squares at a time"""
+        piece = self.get_piece_at(row, col)
+        if piece is None:
+            return 0
+        own = self.occupied[piece.color]
+        island = SQUARE_MASKS[row * 8 + col]
+        while True:
+            grown = island | (neighbours_mask(island) & own)
+            if grown == island:
+                return island
+            island = grown
+
+    def isolated_mask(self, color, removed_square=None):
+        """Pieces of the color that are no longer connected to their king
+
+        Every piece is connected when it is placed and isolated pieces are
+        cleared after every hit, so if we know which square was just emptied
+        and it touched at most one friendly piece nothing can have been cut off.
+        """
+        if removed_square is not None:
+            row, col = removed_square
+            if (ADJACENT_MASKS[row * 8 + col] & self.occupied[color]).bit_count() <= 1:
+                return 0
+        king_position = self.find_king(color)
+        if king_position is None:
+            return 0
+        return self.occupied[color] & ~self.connected_mask(*king_position)
+
+    def piece_positions(self, color, piece_type=None):
+        """Squares holding the player's pieces, optionally only one type"""
+        mask = self.occupied[color] if piece_type is None else self.bitboards[color][piece_type]
+        return list(iter_squares(mask))
 
     def has_pawn(self, color):
         """Checks if the player has a pawn."""
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.PAWN and piece.color == color:
-                    return True
-        return False
+        return self.bitboards[color][PieceType.PAWN] != 0
 
     def has_turret(self, color):
         """Checks if the player has a turret."""
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.TURRET and piece.color == color:
-                    return True
-        return False
+        return self.bitboards[color][PieceType.TURRET] != 0
 
     def count_farms(self, color):
         """Counts the number of farms a player has"""
-        farm_count = 0
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.FARM and piece.color == color:
-                    farm_count += 1
-        return farm_count
+        return self.bitboards[color][PieceType.FARM].bit_count()
 
     def find_king(self, color):
         """Stores the king's position for future reference"""
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.KING and piece.color == color:
-                    return row, col
-        return None
\ No newline at end of file
+        king_mask = self.bitboards[color][PieceType.KING]
+        if not king_mask:
+            return None
+        return divmod(king_mask.bit_length() - 1, 8)
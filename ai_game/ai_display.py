@@ -1,8 +1,13 @@
 
 import pygame
+import os
 import sys
 from ai_game.ai_logic import Game
 from ai_game.q_learning_ai import QLearningAI
+from ai_game.search_ai import SearchAI
+from ai_game.mcts_ai import MCTSAI
+from ai_game.q_checkpoint import QTableCheckpointer
+from ai_game.q_table import last_modified
 from ai_game.ai_pieces import PieceType
 
 pygame.init()
@@ -41,17 +46,34 @@ piece_images = {
     "black_shield": pygame.image.load(assets + "black_shield.png"),
 }
 
+# Prefer the memory-mapped table when one has been exported, it opens without loading everything.
+# Training only updates the pickle though, so once that (or its log) is newer the export is stale.
+Q_TABLE_FILE = 'qtable/q_table.qdb' if last_modified('qtable/q_table.qdb') > last_modified('qtable/q_table.pkl') else 'qtable/q_table.pkl'
+
 def reset_game():
-    global game, q_learning_ai
+    global game, q_learning_ai, search_ai, mcts_ai
     game = Game()
-    q_learning_ai = QLearningAI(game, player_name="AI Player")
-    q_learning_ai.load_q_table('qtable/q_table.pkl')
+    if q_learning_ai is not None:
+        q_table = q_learning_ai.q_table  # Still up to date, no need to read it back in
+        q_learning_ai = QLearningAI(game, player_name="AI Player")
+        q_learning_ai.q_table = q_table
+    search_ai = SearchAI(game, player_name="AI Player")
+    mcts_ai.game = game  # Keeps its worker pool
+    mcts_ai.root = None
 
 game = Game() #game is game
 
-# Initialize q learning
-q_learning_ai = QLearningAI(game, player_name="AI Player")
-q_learning_ai.load_q_table('qtable/q_table.pkl')
+q_learning_ai = None  # Only the Q-learning opponent needs the Q-table, see load_q_learning_ai
+checkpointer = None
+search_ai = SearchAI(game, player_name="AI Player")  # Alpha-beta, about 200 ms per action
+mcts_ai = MCTSAI(game, player_name="AI Player")  # Random rollouts on every core, a second per action
+
+def load_q_learning_ai():
+    """Reads the Q-table and starts checkpointing it"""
+    global q_learning_ai, checkpointer
+    q_learning_ai = QLearningAI(game, player_name="AI Player")
+    q_learning_ai.load_q_table(Q_TABLE_FILE)
+    checkpointer = QTableCheckpointer(q_learning_ai.q_table, Q_TABLE_FILE)
 
 def draw_board():
     for row in range(BOARD_SIZE):
@@ -154,20 +176,15 @@ def draw_board():
 
                 pass
         else:
-            for row in range(BOARD_SIZE):
-                for col in range(BOARD_SIZE):
-                    piece = game.board.get_piece_at(row, col)
-                    if piece and piece.color == current_color and piece.piece_type == PieceType.TURRET:
-                        # Check if this turret has at least one valid target
-                        valid_targets = game.find_valid_targets_for_turret(row, col)
-                        if valid_targets:
-                            border_rect = pygame.Rect(
-                                col * SQUARE_SIZE, 
-                                row * SQUARE_SIZE, 
-                                SQUARE_SIZE, 
-                                SQUARE_SIZE
-                            )
-                            pygame.draw.rect(screen, highlight_color, border_rect, 3)
+            # Only turrets with at least one valid target are in the attack map
+            for row, col in game.find_all_turret_targets(current_color):
+                border_rect = pygame.Rect(
+                    col * SQUARE_SIZE, 
+                    row * SQUARE_SIZE, 
+                    SQUARE_SIZE, 
+                    SQUARE_SIZE
+                )
+                pygame.draw.rect(screen, highlight_color, border_rect, 3)
 
 
 def draw_right_panel():
@@ -324,18 +341,7 @@ def draw_right_panel():
         has_turret = game.board.has_turret(piece_color)
         
         # Checks if any turret has valid targets
-        has_valid_targets = False
-        if has_turret:
-            for row in range(8):
-                for col in range(8):
-                    piece = game.board.get_piece_at(row, col)
-                    if piece and piece.color == piece_color and piece.piece_type == PieceType.TURRET:
-                        valid_targets = game.find_valid_targets_for_turret(row, col)
-                        if valid_targets:
-                            has_valid_targets = True
-                            break
-                if has_valid_targets:
-                    break
+        has_valid_targets = has_turret and bool(game.find_all_turret_targets(piece_color))
         
         can_fire = has_actions and has_turret and not game.pawn_placement_mode and not game.upgrade_mode and has_valid_targets
 
@@ -441,7 +447,8 @@ def handle_mouse_button_down(event, buttons):
     for button in buttons:
         if button.collidepoint(event.pos):
             if game.game_over:
-                q_learning_ai.save_q_table('qtable/q_table.pkl')
+                if checkpointer is not None:
+                    checkpointer.checkpoint()
                 if button == buttons[0]:  # Play Again
                     reset_game()
                 return
@@ -462,17 +469,7 @@ def handle_mouse_button_down(event, buttons):
                 if not game.upgrade_mode and not game.pawn_placement_mode:
                     # Check if any turret has valid targets
                     piece_color = "white" if game.turn.lower().startswith("white") else "black"
-                    has_valid_targets = False
-                    for row in range(8):
-                        for col in range(8):
-                            piece = game.board.get_piece_at(row, col)
-                            if piece and piece.color == piece_color and piece.piece_type == PieceType.TURRET:
-                                valid_targets = game.find_valid_targets_for_turret(row, col)
-                                if valid_targets:
-                                    has_valid_targets = True
-                                    break
-                        if has_valid_targets:
-                            break
+                    has_valid_targets = bool(game.find_all_turret_targets(piece_color))
                     
                     if has_valid_targets:
                         game.initiate_turret_firing()
@@ -500,8 +497,11 @@ def handle_mouse_button_down(event, buttons):
     else:
         game.handle_click(row, col)
 
-def start_ai_game_display():
+def start_ai_game_display(opponent='search'):
+    """opponent is 'search' for the alpha-beta AI, 'mcts' for tree search or 'q_learning' for the (weaker, but learning) Q-table one"""
     pygame.display.set_caption('Territory - Play vs AI')
+    if opponent == 'q_learning' and q_learning_ai is None:
+        load_q_learning_ai()
     running = True
     while running:
         screen.fill((0, 0, 0))
@@ -512,7 +512,8 @@ def start_ai_game_display():
         if game.game_over:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    q_learning_ai.save_q_table('qtable/q_table.pkl')  # Save Q-table
+                    if checkpointer is not None:
+                        checkpointer.close()  # Save Q-table
                     running = False
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     handle_mouse_button_down(event, buttons)
@@ -520,12 +521,17 @@ def start_ai_game_display():
             if game.turn.startswith("white"):  # Human player's turn
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
-                        q_learning_ai.save_q_table('qtable/q_table.pkl')
+                        if checkpointer is not None:
+                            checkpointer.close()
                         running = False
                     if event.type == pygame.MOUSEBUTTONDOWN:
                         handle_mouse_button_down(event, buttons)
             else:  # AI player's turn
-                if game.initial_phase:
+                if opponent == 'search':
+                    search_ai.make_move()
+                elif opponent == 'mcts':
+                    mcts_ai.make_move()
+                elif game.initial_phase:
                     q_learning_ai.initial_placement()
                 else:
                     q_learning_ai.buy_actions()  # Buy me up
@@ -542,6 +548,7 @@ def start_ai_game_display():
                             break
 
                     game.end_turn() 
+                    checkpointer.maybe_checkpoint()
 
         pygame.display.update()
 
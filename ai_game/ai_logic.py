@@ -1,5 +1,7 @@
-from ai_game.ai_board import Board
+from ai_game.ai_board import Board, iter_squares
 from ai_game.ai_pieces import Piece, PieceType
+from ai_game.zobrist import game_hash
+from ai_game.log_levels import move_message
 
 class Game:
     def __init__(self):
@@ -20,6 +22,8 @@ class Game:
         self.scores = {"Player 1": 0, "Player 2": 0}
         self.player1_color = "white"
         self.player2_color = "black"
+        self.undo_stack = []
+        self.quiet = False  # Set while MCTS plays games out, so its imagined wins don't print
 
     def reset_game(self):
         scores = self.scores.copy() 
@@ -115,7 +119,7 @@ class Game:
         row, col = self.selected_pawn
         current_color = "white" if self.turn.lower() == "white" else "black"
         if isinstance(new_type, PieceType):
-            self.board.board[row][col] = Piece(current_color, new_type)
+            self.board.set_piece_at(row, col, Piece(current_color, new_type))
             self.actions[current_color] -= 1
             self.upgrade_mode = False
             self.selected_pawn = None
@@ -153,22 +157,14 @@ class Game:
                 print(f"No valid targets for turret at ({row, col}).")
 
     def find_valid_targets_for_turret(self, turret_row, turret_col):
-        valid_targets = []
         current_color = "white" if self.turn.lower().startswith("white") else "black"
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]  # 4 diagonal directions
+        return self.board.turret_targets(turret_row, turret_col, current_color)
 
-        for row_step, col_step in directions:
-            row, col = turret_row + row_step, turret_col + col_step
-            while 0 <= row < 8 and 0 <= col < 8:
-                piece = self.board.get_piece_at(row, col)
-                if piece:
-                    if piece.color != current_color:
-                        valid_targets.append((row, col))
-                    break
-                row += row_step
-                col += col_step
-
-        return valid_targets
+    def find_all_turret_targets(self, color=None):
+        """Targets for every turret of a color (the current player by default) in one pass"""
+        if color is None:
+            color = "white" if self.turn.lower().startswith("white") else "black"
+        return self.board.turret_attack_map(color)
 
     def validate_turret_target(self, target_row, target_col):
         return (target_row, target_col) in self.valid_targets
@@ -176,73 +172,63 @@ class Game:
     def fire_turret(self, turret_row, turret_col, target_row, target_col):
         """Fire the turret"""
         if self.validate_turret_target(target_row, target_col):
-            target_piece = self.board.get_piece_at(target_row, target_col)
-            if target_piece:
-                if not hasattr(self.board, 'history'):
-                    self.board.history = []
-                self.board.history.append((target_piece, (target_row, target_col)))  # Save the removed piece and its location for undo
-
-                if target_piece.piece_type == PieceType.SHIELD:  # Converts shields into pawns
-                    self.board.board[target_row][target_col] = Piece(target_piece.color, PieceType.PAWN)
-                elif target_piece.piece_type == PieceType.KING:  # If it hits the king, game over
-                    self.board.board[target_row][target_col] = None
-                    self.game_over = True
-                    self.winner = "Player 2" if target_piece.color == self.player1_color else "Player 1"
-                    self.scores[self.winner] += 1 
-                    print(f"Game over! {self.winner} wins!")
-                else:
-                    self.board.board[target_row][target_col] = None  # Removes the piece
-
-                self.selected_turret = None
-                self.valid_targets = []
-                self.firing_mode = False
-                self.remove_isolated_pieces(target_piece.color)
-                current_color = "white" if self.turn.lower() == "white" else "black"
-                self.actions[current_color] -= 1
+            if self.board.get_piece_at(target_row, target_col):
+                self.resolve_turret_hit(target_row, target_col)
             else:
-                print("No piece at target location.")
+                move_message("No piece at target location.")
         else:
             pass
 
+    def resolve_turret_hit(self, target_row, target_col):
+        """Applies a turret shot at an already validated target"""
+        target_piece = self.board.get_piece_at(target_row, target_col)
+        if not hasattr(self.board, 'history'):
+            self.board.history = []
+        self.board.history.append((target_piece, (target_row, target_col)))  # Save the removed piece and its location for undo
+
+        if target_piece.piece_type == PieceType.SHIELD:  # Converts shields into pawns
+            self.board.set_piece_at(target_row, target_col, Piece(target_piece.color, PieceType.PAWN))
+        elif target_piece.piece_type == PieceType.KING:  # If it hits the king, game over
+            self.board.remove_piece(target_row, target_col)
+            self.game_over = True
+            self.winner = "Player 2" if target_piece.color == self.player1_color else "Player 1"
+            self.scores[self.winner] += 1 
+            if not self.quiet:
+                print(f"Game over! {self.winner} wins!")
+        else:
+            self.board.remove_piece(target_row, target_col)  # Removes the piece
+
+        self.selected_turret = None
+        self.valid_targets = []
+        self.firing_mode = False
+        if target_piece.piece_type != PieceType.SHIELD:  # A shield turns into a pawn, so nothing gets cut off
+            self.remove_isolated_pieces(target_piece.color, (target_row, target_col))
+        current_color = "white" if self.turn.lower() == "white" else "black"
+        self.actions[current_color] -= 1
+
     def get_connected_pieces(self, start_row, start_col):
-        """Uses BFS to find all connected pieces to the king"""
-        visited = set()
-        mylist = [(start_row, start_col)]
-        directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]  # Only horizontal and vertical directions count, no diagonals
-
-        while mylist:
-            row, col = mylist.pop(0)
-            if (row, col) in visited:
-                continue
-            visited.add((row, col))
-            for dr, dc in directions:
-                new_row, new_col = row + dr, col + dc
-                if 0 <= new_row < 8 and 0 <= new_col < 8:
-                    piece = self.board.get_piece_at(new_row, new_col)
-                    if piece and piece.color == self.board.get_piece_at(start_row, start_col).color:
-                        mylist.append((new_row, new_col))
-        return visited
-
-    def remove_isolated_pieces(self, color):
-        """Removes all pieces that aren't part of the main island"""
+        """Finds all pieces connected to the start square (only horizontal and vertical count, no diagonals)"""
+        return set(iter_squares(self.board.connected_mask(start_row, start_col)))
+
+    def remove_isolated_pieces(self, color, removed_square=None):
+        """Removes all pieces that aren't part of the main island
+
+        removed_square is the square that was just emptied, if known, which
+        lets the board skip the island check when nothing can have been cut off.
+        """
         if not self.game_over:
-            king_position = self.board.find_king(color)
-            connected_pieces = self.get_connected_pieces(*king_position)
             piececount = 0
             removed_pieces = []
-            for row in range(8):
-                for col in range(8):
-                    piece = self.board.get_piece_at(row, col)
-                    if piece and piece.color == color and (row, col) not in connected_pieces:
-                        removed_pieces.append((piece, (row, col)))
-                        self.board.board[row][col] = None
-                        piececount += 1
+            for row, col in iter_squares(self.board.isolated_mask(color, removed_square)):
+                piece = self.board.remove_piece(row, col)
+                removed_pieces.append((piece, (row, col)))
+                piececount += 1
             if piececount > 0:
                 self.board.history.append(('isolated', removed_pieces))  # Save the isolated pieces for undo
                 if piececount == 1:
-                    print('1 isolated piece lost :(')
+                    move_message('1 isolated piece lost :(')
                 elif piececount > 1:
-                    print(f"{piececount} isolated pieces lost!")
+                    move_message(f"{piececount} isolated pieces lost!")
 
     def buy_action(self):
         """Allow the player to buy an action if they have at least 3 action points."""
@@ -278,6 +264,96 @@ class Game:
         self.turn = "black" if current_color == "white" else "white"
         self.reset_actions()
 
+    def zobrist_hash(self):
+        """64-bit key for the current position, turn and action counts"""
+        return game_hash(self)
+
+    def legal_moves(self):
+        """Every move push() accepts in the current position"""
+        if self.game_over:
+            return []
+        color = "white" if self.turn.startswith("white") else "black"
+        if self.initial_phase:
+            if self.turn.endswith("king"):
+                return [('place_king', row, col) for row in range(8) for col in range(8)
+                        if self.board.is_valid_initial_placement(row, col) and self.board.get_piece_at(row, col) is None]
+            king_row, king_col = self.board.king_positions[color]
+            return [('place_farm', row, col) for row, col in [(king_row-1, king_col), (king_row+1, king_col), (king_row, king_col-1), (king_row, king_col+1)]
+                    if self.board.is_valid_position(row, col) and self.board.is_valid_initial_placement(row, col)
+                    and self.board.get_piece_at(row, col) is None]
+
+        moves = []
+        if self.actions[color] > 0:
+            for row, col in iter_squares(self.board.pawn_placement_mask(color)):
+                moves.append(('place_pawn', row, col))
+            for row, col in iter_squares(self.board.bitboards[color][PieceType.PAWN]):
+                for new_type in (PieceType.FARM, PieceType.TURRET, PieceType.SHIELD):
+                    moves.append(('upgrade_pawn', row, col, new_type))
+            for (row, col), targets in self.board.turret_attack_map(color).items():
+                for target_row, target_col in targets:
+                    moves.append(('fire_turret', row, col, target_row, target_col))
+        if self.action_points[color] >= 3:
+            moves.append(('buy_action',))
+        moves.append(('end_turn',))
+        return moves
+
+    def push(self, move):
+        """Applies a move so that pop() can take it back exactly
+
+        Moves use the same tuples as the AIs: ('place_pawn', row, col),
+        ('upgrade_pawn', row, col, PieceType), ('fire_turret', turret_row,
+        turret_col, target_row, target_col), plus ('buy_action',),
+        ('end_turn',) and the opening ('place_king', row, col) /
+        ('place_farm', row, col). The move is assumed to be legal.
+        """
+        history = getattr(self.board, 'history', None)
+        undo = (self.turn, self.initial_phase, self.actions.copy(), self.action_points.copy(),
+                self.game_over, self.winner, self.scores.copy(), self.firing_mode, self.selected_turret,
+                self.valid_targets, None if history is None else len(history), [])
+        self.board.journal = undo[-1]
+        try:
+            self._apply_move(move)
+        finally:
+            self.board.journal = None
+        self.undo_stack.append(undo)
+
+    def pop(self):
+        """Takes back the last pushed move"""
+        (self.turn, self.initial_phase, self.actions, self.action_points, self.game_over, self.winner,
+         self.scores, self.firing_mode, self.selected_turret, self.valid_targets, history_length,
+         journal) = self.undo_stack.pop()
+        self.board.undo_journal(journal)
+        if history_length is None:
+            if hasattr(self.board, 'history'):
+                del self.board.history
+        else:
+            del self.board.history[history_length:]
+
+    def _apply_move(self, move):
+        color = "white" if self.turn.startswith("white") else "black"
+        kind = move[0]
+        if kind == 'place_pawn':
+            self.board.place_piece(move[1], move[2], PieceType.PAWN, color)
+            self.actions[color] -= 1
+        elif kind == 'upgrade_pawn':
+            self.board.set_piece_at(move[1], move[2], Piece(color, move[3]))
+            self.actions[color] -= 1
+        elif kind == 'fire_turret':
+            self.resolve_turret_hit(move[3], move[4])
+        elif kind == 'buy_action':
+            self.action_points[color] -= 3
+            self.actions[color] += 1
+        elif kind == 'end_turn':
+            self.end_turn()
+        elif kind == 'place_king':
+            self.board.place_piece(move[1], move[2], PieceType.KING, color)
+            self.advance_turn()
+        elif kind == 'place_farm':
+            self.board.place_piece(move[1], move[2], PieceType.FARM, color)
+            self.advance_turn()
+        else:
+            raise ValueError(f"Unknown move: {move}")
+
     def swap_colors(self):
         self.player1_color, self.player2_color = self.player2_color, self.player1_color
         print(f"Colors swapped. Player 1 is now {self.player1_color.capitalize()} and Player 2 is now {self.player2_color.capitalize()}.")
\ No newline at end of file
@@ -2,22 +2,20 @@ from ai_game.ai_pieces import PieceType
 
 def evaluate_board(game):
     score = 0
-    for row in range(8):
-        for col in range(8):
-            piece = game.board.get_piece_at(row, col)
-            if piece:
-                piece_value = get_piece_value(piece)
-                score += piece_value
+    bitboards = game.board.bitboards
+    for piece_type, piece_value in PIECE_VALUES.items():
+        score += piece_value * (bitboards["white"][piece_type].bit_count() - bitboards["black"][piece_type].bit_count())
 
     return score
 
+PIECE_VALUES = {
+    PieceType.KING: 1000,
+    PieceType.PAWN: 3,
+    PieceType.FARM: 7,
+    PieceType.TURRET: 6,
+    PieceType.SHIELD: 6
+}
+
 def get_piece_value(piece):
-    piece_values = {
-        PieceType.KING: 1000,
-        PieceType.PAWN: 3,
-        PieceType.FARM: 7,
-        PieceType.TURRET: 6,
-        PieceType.SHIELD: 6
-    }
-    value = piece_values.get(piece.piece_type, 0)
-    return value if piece.color == "white" else -value
\ No newline at end of file
+    value = PIECE_VALUES.get(piece.piece_type, 0)
+    return value if piece.color == "white" else -value
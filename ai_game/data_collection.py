@@ -1,21 +1,103 @@
+import atexit
 import csv
+import io
 import os
+import queue
+import threading
+from collections import namedtuple
 from datetime import datetime
 from ai_game.ai_pieces import PieceType
+from ai_game.state_encoding import CODE_PIECES
+from ai_game import log_levels
+from ai_game.game_records import pack_game_end, pack_record, write_header
+from ai_game.move_records import move_code, pack_game, pack_keyframe, write_header as write_moves_header
 
 
 '''I'm the collector baby'''
 
+# What serialize_game_state needs, cheap enough to take on the game thread
+GameStateSnapshot = namedtuple('GameStateSnapshot', ['packed', 'action_points', 'turn', 'actions'])
+
 class DataCollector:
-    def __init__(self, file_name='game_data.csv'):
+    """Appends rows to a CSV file from a background thread
+
+    log_data and log_game_end only put a record on a bounded queue, and
+    block when it's full so a slow disk holds the game back instead of
+    eating memory. The writer thread formats the rows into a buffer and
+    writes that to a file it keeps open, once flush_rows rows or
+    flush_bytes bytes have piled up and at the end of every game.
+
+    A file name ending in .bin gets the binary records of
+    ai_game.game_records instead of CSV rows. One ending in .moves ignores
+    the rows and keeps every game as the move list log_move records, with
+    a keyframe every keyframe_interval moves, see ai_game.move_records.
+
+    log_level (by default the one set in ai_game.log_levels) picks between
+    a row per move, a row every sample_every moves, or only a summary row
+    per episode. Summaries go to <file name>_summary.csv instead.
+    """
+    _shared = {}  # (file name, log level) -> collector, see shared()
+
+    def __init__(self, file_name='game_data.csv', flush_rows=256, flush_bytes=1 << 20, queue_size=4096, keyframe_interval=32,
+                 log_level=None, sample_every=None):
+        self.log_level = log_level or log_levels.level
+        self.sample_every = sample_every or log_levels.sample_every
+        self.summary = self.log_level == log_levels.SUMMARY
+        if self.summary:
+            file_name = os.path.splitext(file_name)[0] + '_summary.csv'
+            self.fieldnames = ['episode', 'winner', 'turns', 'moves', 'total_reward', 'mean_abs_q_change', 'exploration_ratio']
+        else:
+            self.fieldnames = [
+                'game_state', 'action', 'outcome', 'board_evaluation', 'reward', 'winner', 
+                'loser', 'episode', 'turn', 'q_value', 'q_value_change', 'exploration', 'current_turn', 'cumulative_reward'
+            ]
         self.file_name = file_name
-        self.fieldnames = [
-            'game_state', 'action', 'outcome', 'board_evaluation', 'reward', 'winner', 
-            'loser', 'episode', 'turn', 'q_value', 'q_value_change', 'exploration', 'current_turn', 'cumulative_reward'
-        ]
+        self.rows_offered = 0
+        self.reset_stats()
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.move_list = file_name.endswith('.moves')
+        self.binary = file_name.endswith('.bin') or self.move_list
+        self.keyframe_interval = max(8, keyframe_interval)  # The 4 initial placements are logged mid-turn, keep keyframes clear of them
+        self.move_count = 0  # Moves of the current game so far, counted on the game thread
+        self.game_moves = []  # The current game's codes and keyframes, kept by the writer thread
+        self.game_keyframes = []
+        self.index = []  # Offsets of game blocks not yet added to the .idx file
+        if self.binary:
+            self.buffer = io.BytesIO()
+        else:
+            self.buffer = io.StringIO(newline='')
+            self.writer = csv.DictWriter(self.buffer, fieldnames=self.fieldnames)
+            self.row_writer = csv.writer(self.buffer)
+        self.pending_rows = 0
+        self.file = None
+        self.records = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.error = None  # What the writer thread failed on, raised on the game thread by the next call
+        self.error_raised = False
+        self.pid = os.getpid()  # A forked child gets a copy of the queue, only the owner may write it out
         self.ensure_csv_file()
+        self.file_size = os.path.getsize(self.file_name)
+
+    @classmethod
+    def shared(cls, file_name='game_data.csv'):
+        """The one collector for a file in this process, so every agent writes through the same queue"""
+        key = (file_name, log_levels.level)
+        collector = cls._shared.get(key)
+        if collector is None or collector.pid != os.getpid():
+            collector = cls(file_name)
+            cls._shared[key] = collector
+            atexit.register(collector.close)
+        return collector
 
     def ensure_csv_file(self):
+        if self.binary:
+            try:
+                with open(self.file_name, mode='xb') as file:
+                    (write_moves_header if self.move_list else write_header)(file)
+            except FileExistsError:
+                pass
+            return
         try:
             with open(self.file_name, mode='x', newline='') as file:
                 writer = csv.DictWriter(file, fieldnames=self.fieldnames)
@@ -23,7 +105,56 @@ class DataCollector:
         except FileExistsError:
             pass
 
-    def log_data(self, game_state, action, outcome, board_evaluation, reward, winner=None, loser=None, episode=None, turn=None, q_value=None, q_value_change=None, exploration=None, current_turn=None, cumulative_reward=None):
+    def _put(self, record):
+        self._raise_error()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._write_records, daemon=True)
+            self.thread.start()
+        self.records.put(record)
+
+    def _raise_error(self):
+        if self.error is not None:
+            self.error_raised = True
+            raise self.error
+
+    def wants_row(self):
+        """Whether a log_data row for the next move would be kept, callers skip building the ones that aren't"""
+        if self.summary or self.move_list:
+            return False
+        if self.log_level == log_levels.FULL:
+            return True
+        self.rows_offered += 1
+        return self.rows_offered % self.sample_every == 1 or self.sample_every == 1
+
+    def reset_stats(self):
+        self.stats_moves = 0
+        self.stats_reward = 0.0
+        self.stats_q_change = 0.0
+        self.stats_explored = 0
+
+    def add_move_stats(self, reward, q_value_change, exploration):
+        """Adds one move to the running totals of the episode summary"""
+        self.stats_moves += 1
+        self.stats_reward += reward or 0
+        self.stats_q_change += abs(q_value_change or 0)
+        self.stats_explored += bool(exploration)
+
+    def log_episode_summary(self, episode, winner, turns):
+        """Writes the summary row of the episode in summary mode, and starts the totals over"""
+        if self.summary:
+            moves = max(self.stats_moves, 1)
+            self._put(('summary', {
+                'episode': episode,
+                'winner': winner,
+                'turns': turns,
+                'moves': self.stats_moves,
+                'total_reward': self.stats_reward,
+                'mean_abs_q_change': self.stats_q_change / moves,
+                'exploration_ratio': self.stats_explored / moves,
+            }))
+        self.reset_stats()
+
+    def log_data(self, game_state, action, outcome, board_evaluation, reward, winner=None, loser=None, episode=None, turn=None, q_value=None, q_value_change=None, exploration=None, current_turn=None, cumulative_reward=None, action_id=None, state=None):
         data = {
             'game_state': game_state,
             'action': action,
@@ -39,14 +170,141 @@ class DataCollector:
             'current_turn': current_turn,
             'cumulative_reward': cumulative_reward
         }
-        with open(self.file_name, mode='a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=self.fieldnames)
-            writer.writerow(data)
+        if not self.move_list and not self.summary:
+            self._put(('row', (data, turn, action_id, state)))
+
+    def log_move(self, game, move):
+        """Records a move right after it was played, only .moves files keep these"""
+        if not self.move_list:
+            return
+        new_game = move[0] == 'place_king' and game.board.all_occupied().bit_count() == 1
+        if new_game:
+            self.move_count = 0
+        self.move_count += 1
+        keyframe = pack_keyframe(game, self.move_count) if self.move_count % self.keyframe_interval == 0 else None
+        self._put(('move', (move_code(move), keyframe, new_game)))
 
     def log_game_end(self, episode):
-        with open(self.file_name, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['---', 'End of Game', '---', '', '', '', '', '', episode, '', '', '', '', ''])
+        if not self.summary:
+            self._put(('end', episode))
+
+    def flush(self):
+        """Waits until everything logged so far is in the file"""
+        if self.thread is not None and self.pid == os.getpid():
+            self._put(('flush', None))
+            self.records.join()
+            self._raise_error()
+
+    def close(self):
+        if self.thread is not None and self.pid == os.getpid():
+            self.records.put(('close', None))  # Even after an error, so the file gets closed
+            self.thread.join()
+            self.thread = None
+            if not self.error_raised:
+                self._raise_error()
+
+    def _write_records(self):
+        while True:
+            kind, value = self.records.get()
+            try:
+                if self.error is None:
+                    self._write_record(kind, value)
+                if kind == 'close':
+                    if self.error is None and self.game_moves:
+                        self._write_game(None, finished=False)
+                        self._write_buffer()
+                    if self.file is not None:
+                        self.file.close()
+                        self.file = None
+            except Exception as error:
+                # Kept for the game thread to raise, the queue still gets drained so nothing waiting on it hangs
+                self.error = error
+            finally:
+                self.records.task_done()
+            if kind == 'close':
+                return
+
+    def _write_record(self, kind, value):
+        if kind == 'row':
+            data, turn, action_id, state = value
+            if self.binary:
+                self.buffer.write(pack_record(data, turn, action_id, state))
+            else:
+                if isinstance(data['game_state'], GameStateSnapshot):
+                    data['game_state'] = self.expand_game_state(data['game_state'])
+                self.writer.writerow(data)
+            self.pending_rows += 1
+            if self.pending_rows >= self.flush_rows or self.buffer.tell() >= self.flush_bytes:
+                self._write_buffer()
+        elif kind == 'summary':
+            self.writer.writerow(value)
+            self._write_buffer()
+        elif kind == 'move':
+            code, keyframe, new_game = value
+            if new_game and self.game_moves:
+                self._write_game(None, finished=False)  # The last game stopped without an end, e.g. at max_turns
+            self.game_moves.append(code)
+            if keyframe is not None:
+                self.game_keyframes.append(keyframe)
+        elif kind == 'end':
+            if self.move_list:
+                if self.game_moves:
+                    self._write_game(value, finished=True)
+            elif self.binary:
+                self.buffer.write(pack_game_end(value))
+            else:
+                self.row_writer.writerow(['---', 'End of Game', '---', '', '', '', '', '', value, '', '', '', '', ''])
+            self._write_buffer()
+        else:
+            self._write_buffer()
+
+    def _write_game(self, episode, finished):
+        self.index.append(self.file_size + self.buffer.tell())
+        self.buffer.write(pack_game(self.game_moves, self.game_keyframes, self.keyframe_interval, episode, finished))
+        self.game_moves = []
+        self.game_keyframes = []
+
+    def _write_buffer(self):
+        if self.buffer.tell():
+            if self.file is None:
+                self.file = open(self.file_name, mode='ab') if self.binary else open(self.file_name, mode='a', newline='')
+            self.file_size += self.file.write(self.buffer.getvalue())
+            self.file.flush()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        if self.index:
+            # After the data, so the index never points past the end of the file
+            with open(self.file_name + '.idx', mode='ab') as index_file:
+                index_file.write(b''.join(offset.to_bytes(8, 'little') for offset in self.index))
+            self.index = []
+        self.pending_rows = 0
+
+    def snapshot_game_state(self, game):
+        """Takes the place of serialize_game_state for log_data, the writer thread expands it"""
+        return GameStateSnapshot(game.board.packed, dict(game.action_points), game.turn, dict(game.actions))
+
+    def expand_game_state(self, snapshot):
+        """The same dict serialize_game_state gives for the game the snapshot was taken of"""
+        pieces = []
+        packed = snapshot.packed
+        square = 0
+        while packed:
+            code = packed & 0xF
+            if code:
+                color, piece_type = CODE_PIECES[code]
+                pieces.append({
+                    'type': piece_type.name,
+                    'color': color,
+                    'position': divmod(square, 8)
+                })
+            packed >>= 4
+            square += 1
+        return {
+            'pieces': pieces,
+            'action_points': snapshot.action_points,
+            'turn': snapshot.turn
+        }
+
     def serialize_game_state(self, game):
         pieces = []
         for row in range(8):
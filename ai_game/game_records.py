@@ -0,0 +1,125 @@
+import os
+import struct
+import numpy as np
+
+from ai_game.state_encoding import KEY_BYTES, TURNS, TURN_INDEXES
+
+'''Binary game log, an alternative to game_data.csv
+
+A 16 byte header, then one fixed size little-endian record per logged move
+or game end, so a whole log can be mapped straight into a NumPy structured
+array. The board is the 32 byte packed board from ai_game.state_encoding,
+two squares per byte, low nibble first. Missing numbers are NaN, missing
+small fields -1 or 0 as noted in RECORD_DTYPE. Version 2 added the
+actions and state fields, version 1 logs still read fine without them.'''
+
+MAGIC = b'TGR2'
+HEADER = struct.Struct('<4sI8x')
+
+OUTCOMES = ('in_progress', 'win', 'draw')  # Anything else is stored as 255
+PLAYERS = (None, 'Player 1', 'Player 2')  # Any other name is stored as 3
+MOVE = 0
+GAME_END = 1
+
+_FIELDS = [
+    ('kind', 'u1'),  # MOVE or GAME_END, the other fields of a game end are empty apart from episode
+    ('turn', 'u1'),  # Index into TURNS of game.turn after the move
+    ('outcome', 'u1'),
+    ('winner', 'u1'),
+    ('loser', 'u1'),
+    ('exploration', 'i1'),  # 1, 0 or -1 if not given
+    ('action_id', '<i2'),  # See ai_game.q_table, -1 if not given
+    ('action_points', 'u1', (2,)),  # White then black, clamped to 255
+    ('episode', '<i4'),
+    ('turn_count', '<i4'),
+    ('board', 'u1', (32,)),
+    ('board_evaluation', '<f4'),
+    ('reward', '<f4'),
+    ('q_value', '<f4'),
+    ('q_value_change', '<f4'),
+    ('cumulative_reward', '<f4'),
+]
+RECORD_DTYPE = np.dtype(_FIELDS + [
+    ('actions', 'u1', (2,)),  # White then black after the move, clamped to 255
+    ('state', 'u1', (KEY_BYTES,)),  # The ai_game.state_encoding key before the move, all zero if not given
+])
+RECORD = struct.Struct(f'<BBBBBbh2Bii32s5f2B{KEY_BYTES}s')
+assert RECORD.size == RECORD_DTYPE.itemsize
+RECORD_DTYPES = {b'TGR1': np.dtype(_FIELDS), MAGIC: RECORD_DTYPE}
+
+NAN = float('nan')
+
+
+def _number(value):
+    return NAN if value is None else float(value)
+
+
+def _player(name):
+    return PLAYERS.index(name) if name in PLAYERS else 3
+
+
+def pack_record(data, turn_count=None, action_id=None, state=None):
+    """One MOVE record from a DataCollector row whose game_state is a GameStateSnapshot"""
+    snapshot = data['game_state']
+    action_points = snapshot.action_points
+    actions = snapshot.actions
+    exploration = data['exploration']
+    return RECORD.pack(
+        MOVE,
+        TURN_INDEXES[snapshot.turn],
+        OUTCOMES.index(data['outcome']) if data['outcome'] in OUTCOMES else 255,
+        _player(data['winner']),
+        _player(data['loser']),
+        -1 if exploration is None else int(exploration),
+        -1 if action_id is None else action_id,
+        max(0, min(action_points["white"], 255)),
+        max(0, min(action_points["black"], 255)),
+        data['episode'] or 0,
+        turn_count or 0,
+        snapshot.packed.to_bytes(32, 'little'),
+        _number(data['board_evaluation']),
+        _number(data['reward']),
+        _number(data['q_value']),
+        _number(data['q_value_change']),
+        _number(data['cumulative_reward']),
+        max(0, min(actions["white"], 255)),
+        max(0, min(actions["black"], 255)),
+        (state or 0).to_bytes(KEY_BYTES, 'little'),
+    )
+
+
+def pack_game_end(episode):
+    return RECORD.pack(GAME_END, 0, 255, 0, 0, -1, -1, 0, 0, episode or 0, 0, bytes(32), NAN, NAN, NAN, NAN, NAN, 0, 0, bytes(KEY_BYTES))
+
+
+def write_header(file):
+    file.write(HEADER.pack(MAGIC, RECORD.size))
+
+
+def read_game_records(file_path):
+    """Maps a binary game log as a read-only structured array of RECORD_DTYPE
+
+    Version 1 logs come back without the actions and state fields.
+    """
+    with open(file_path, 'rb') as file:
+        magic, record_size = HEADER.unpack(file.read(HEADER.size))
+    dtype = RECORD_DTYPES.get(magic)
+    if dtype is None or record_size != dtype.itemsize:
+        raise ValueError(f"{file_path} is not a binary game log")
+    count = (os.path.getsize(file_path) - HEADER.size) // record_size  # A record cut short by a crash is left out
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', offset=HEADER.size, shape=(count,))
+
+
+def board_codes(records):
+    """(records, 64) array of piece codes, see ai_game.state_encoding.PIECE_CODES"""
+    boards = records['board']
+    codes = np.empty(boards.shape[:-1] + (64,), dtype=np.uint8)
+    codes[..., 0::2] = boards & 0xF
+    codes[..., 1::2] = boards >> 4
+    return codes
+
+
+def turn_names(records):
+    return np.array(TURNS)[records['turn']]
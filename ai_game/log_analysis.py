@@ -0,0 +1,154 @@
+import csv
+import sys
+
+'''Streaming reader for game_data.csv
+
+Training logs get far too big to load whole, so everything here walks the
+file one row at a time and only ever holds the totals of the game it's in
+plus the running totals of the whole run.'''
+
+END_OF_GAME = ['---', 'End of Game', '---']
+FIELDS = ['game_state', 'action', 'outcome', 'board_evaluation', 'reward', 'winner', 'loser', 'episode', 'turn',
+          'q_value', 'q_value_change', 'exploration', 'current_turn', 'cumulative_reward']
+
+
+def _number(value):
+    return float(value) if value not in ('', None) else None
+
+
+def iter_rows(file_path, columns=None):
+    """Yields every move row as a dict, and {'end_of_game': episode} for the sentinel rows
+
+    columns limits the dict to some fields, which skips building the
+    huge game_state and action strings into it.
+    """
+    positions = [(name, FIELDS.index(name)) for name in (columns or FIELDS)]
+    # game_state cells are long reprs, more than the csv module's default limit on big boards
+    csv.field_size_limit(max(csv.field_size_limit(), 1 << 24))
+    with open(file_path, newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Header
+        for row in reader:
+            if row[:3] == END_OF_GAME:
+                yield {'end_of_game': row[8]}
+            elif len(row) == len(FIELDS):
+                yield {name: row[index] for name, index in positions}
+
+
+def iter_games(file_path):
+    """Yields one dict of totals per game
+
+    A game ends at its End of Game row, or where the episode number
+    changes for games that hit the turn limit without one.
+    """
+    game = None
+    columns = ['outcome', 'reward', 'winner', 'episode', 'q_value_change', 'exploration', 'current_turn', 'cumulative_reward']
+    for row in iter_rows(file_path, columns):
+        if 'end_of_game' in row:
+            if game is not None:
+                game['finished'] = True
+                yield game
+            game = None
+            continue
+        if game is not None and row['episode'] != game['episode']:
+            yield game
+            game = None
+        if game is None:
+            game = {'episode': row['episode'], 'moves': 0, 'turns': 0, 'total_reward': 0.0, 'final_cumulative_reward': None,
+                    'abs_q_change': 0.0, 'explored': 0, 'winner': None, 'winner_color': None, 'outcome': None,
+                    'finished': False, 'last_turn': None}
+        game['moves'] += 1
+        if row['current_turn'] != game['last_turn']:
+            game['turns'] += 1  # Player turns with at least one logged move
+            game['last_turn'] = row['current_turn']
+        game['total_reward'] += _number(row['reward']) or 0.0
+        game['final_cumulative_reward'] = _number(row['cumulative_reward'])
+        game['abs_q_change'] += abs(_number(row['q_value_change']) or 0.0)
+        game['explored'] += row['exploration'] == 'True'
+        game['outcome'] = row['outcome']
+        if row['outcome'] == 'win':
+            game['winner'] = row['winner'] or None
+            game['winner_color'] = row['current_turn']  # The winning shot is fired on the winner's turn
+    if game is not None:
+        yield game
+
+
+class TrainingStats:
+    """Running totals over games from iter_games, plus curves bucketed every window games"""
+    def __init__(self, window=100):
+        self.window = window
+        self.games = 0
+        self.finished = 0
+        self.wins = {'white': 0, 'black': 0}
+        self.draws = 0
+        self.turns = 0
+        self.moves = 0
+        self.explored = 0
+        self.reward_curve = []  # Mean total reward per game, one point per window
+        self.q_change_curve = []  # Mean |change in Q| per move, one point per window
+        self.win_rate_curve = []  # Share of finished games white won, one point per window
+        self._bucket = [0, 0.0, 0.0, 0, 0, 0]  # games, reward, |dQ|, moves, finished, white wins
+
+    def add(self, game):
+        self.games += 1
+        self.turns += game['turns']
+        self.moves += game['moves']
+        self.explored += game['explored']
+        if game['finished']:
+            self.finished += 1
+            if game['winner_color'] in self.wins:
+                self.wins[game['winner_color']] += 1
+            elif game['outcome'] == 'draw':
+                self.draws += 1
+        bucket = self._bucket
+        bucket[0] += 1
+        bucket[1] += game['total_reward']
+        bucket[2] += game['abs_q_change']
+        bucket[3] += game['moves']
+        bucket[4] += game['finished']
+        bucket[5] += game['winner_color'] == 'white'
+        if bucket[0] == self.window:
+            self._close_bucket()
+
+    def _close_bucket(self):
+        games, reward, q_change, moves, finished, white_wins = self._bucket
+        if games:
+            self.reward_curve.append(reward / games)
+            self.q_change_curve.append(q_change / moves if moves else 0.0)
+            self.win_rate_curve.append(white_wins / finished if finished else None)
+        self._bucket = [0, 0.0, 0.0, 0, 0, 0]
+
+    def report(self):
+        """Totals as a dict, the curves include the last partial window"""
+        if self._bucket[0]:
+            self._close_bucket()
+        games = max(self.games, 1)
+        decided = max(self.wins['white'] + self.wins['black'], 1)
+        return {
+            'games': self.games,
+            'finished': self.finished,
+            'white_win_rate': self.wins['white'] / decided,
+            'black_win_rate': self.wins['black'] / decided,
+            'draws': self.draws,
+            'mean_turns': self.turns / games,
+            'mean_moves': self.moves / games,
+            'exploration_ratio': self.explored / max(self.moves, 1),
+            'reward_curve': self.reward_curve,
+            'q_change_curve': self.q_change_curve,
+            'white_win_rate_curve': self.win_rate_curve,
+        }
+
+
+def analyze(file_path='game_data.csv', window=100):
+    stats = TrainingStats(window)
+    for game in iter_games(file_path):
+        stats.add(game)
+    return stats.report()
+
+
+if __name__ == "__main__":
+    report = analyze(*sys.argv[1:2])
+    for key, value in report.items():
+        if isinstance(value, list):
+            value = ' '.join('-' if point is None else f"{point:.3g}" for point in value)
+        print(f"{key}: {value}")
@@ -0,0 +1,36 @@
+'''How much the engine, the agents and DataCollector report
+
+    full     every move gets its log row and its prints
+    sample   only every sample_every-th one does
+    summary  one row per episode and no per-move prints at all
+Per-episode prints (game over, episode done) show at every level.'''
+
+FULL = 'full'
+SAMPLE = 'sample'
+SUMMARY = 'summary'
+LEVELS = (FULL, SAMPLE, SUMMARY)
+
+level = FULL
+sample_every = 10
+_move_messages = 0
+
+
+def set_log_level(new_level, every=None):
+    """Sets the level for this process, DataCollectors made afterwards pick it up too"""
+    global level, sample_every
+    if new_level not in LEVELS:
+        raise ValueError(f"Unknown log level {new_level!r}, expected one of {LEVELS}")
+    level = new_level
+    if every is not None:
+        sample_every = max(1, every)
+
+
+def move_message(message):
+    """Prints a per-move message if the level lets it through"""
+    global _move_messages
+    if level == FULL:
+        print(message)
+    elif level == SAMPLE:
+        _move_messages += 1
+        if _move_messages % sample_every == 1 or sample_every == 1:
+            print(message)
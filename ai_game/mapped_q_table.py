@@ -0,0 +1,215 @@
+import os
+import struct
+from collections import OrderedDict
+import numpy as np
+
+from ai_game.q_table import ACTION_COUNT
+from ai_game.state_encoding import KEY_BYTES, state_fingerprint
+
+'''Q-table file that gets memory-mapped instead of unpickled
+
+Layout, every section starts on an 8 byte boundary:
+    header        magic, state count n, entry count m
+    fingerprints  uint64[n]       sorted, so a state is found by binary search
+    offsets       uint64[n + 1]   state i owns entries offsets[i] to offsets[i + 1]
+    keys          uint8[n, 40]    full packed states, compared on a fingerprint match
+    action_ids    uint16[m]       only the non-zero Q-values are stored
+    cells         float32[m]
+Opening the file reads nothing but the header, rows get paged in the first
+time a state is looked up and then sit in a small LRU cache.'''
+
+MAGIC = b'TQT1'
+HEADER = struct.Struct('<4s4xQQ')
+
+
+def _padded(size):
+    return (size + 7) // 8 * 8
+
+
+def write_mapped_q_table(q_table, file_path):
+    """Writes any Q-table with iter_rows() in the mapped format"""
+    states = []
+    for state, row in q_table.iter_rows():
+        action_ids = np.flatnonzero(row)
+        if len(action_ids):
+            states.append((state_fingerprint(state), state, action_ids.astype(np.uint16), row[action_ids].astype(np.float32)))
+    states.sort(key=lambda entry: entry[0])
+
+    fingerprints = np.array([entry[0] for entry in states], dtype=np.uint64)
+    offsets = np.zeros(len(states) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(entry[2]) for entry in states], dtype=np.uint64)
+    keys = b''.join(entry[1].to_bytes(KEY_BYTES, 'little') for entry in states)
+    action_ids = np.concatenate([entry[2] for entry in states]) if states else np.zeros(0, dtype=np.uint16)
+    cells = np.concatenate([entry[3] for entry in states]) if states else np.zeros(0, dtype=np.float32)
+
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(states), len(cells)))
+        file.write(fingerprints.tobytes())
+        file.write(offsets.tobytes())
+        file.write(keys)
+        file.write(action_ids.tobytes())
+        file.write(b'\0' * (_padded(action_ids.nbytes) - action_ids.nbytes))
+        file.write(cells.tobytes())
+    os.replace(temp_path, file_path)
+
+
+class MappedQTable:
+    """Read-mostly Q-table backed by a mapped file, same interface as QTable
+
+    Writes are kept in memory (and never evicted) until save() folds them
+    into a new file.
+    """
+    def __init__(self, file_path, cache_size=4096):
+        self.file_path = file_path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # state -> row or None if not in the file, oldest first
+        self.dirty = {}  # state -> row written since the file was opened
+        self.new_states = 0
+        self.touched = None  # While checkpointing, states written since the last checkpoint
+        self.hits = 0
+        self.misses = 0
+        self._open()
+
+    def _open(self):
+        self._raw = None
+        self.fingerprints = np.zeros(0, dtype=np.uint64)
+        self.offsets = np.zeros(1, dtype=np.uint64)
+        self.keys = np.zeros((0, KEY_BYTES), dtype=np.uint8)
+        self.action_ids = np.zeros(0, dtype=np.uint16)
+        self.cells = np.zeros(0, dtype=np.float32)
+        if not os.path.exists(self.file_path):
+            return
+        raw = np.memmap(self.file_path, dtype=np.uint8, mode='r')
+        magic, state_count, entry_count = HEADER.unpack(raw[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{self.file_path} is not a mapped Q-table")
+        offset = HEADER.size
+        sections = []
+        for dtype, count in [(np.uint64, state_count), (np.uint64, state_count + 1), (np.uint8, state_count * KEY_BYTES),
+                             (np.uint16, entry_count), (np.float32, entry_count)]:
+            size = count * np.dtype(dtype).itemsize
+            sections.append(raw[offset:offset + size].view(dtype))
+            offset += _padded(size)
+        self.fingerprints, self.offsets, keys, self.action_ids, self.cells = sections
+        self.keys = keys.reshape(state_count, KEY_BYTES)
+        self._raw = raw
+
+    def _file_row(self, state):
+        fingerprint = np.uint64(state_fingerprint(state))
+        key = state.to_bytes(KEY_BYTES, 'little')
+        index = int(np.searchsorted(self.fingerprints, fingerprint))
+        # States sharing a fingerprint sit next to each other
+        while index < len(self.fingerprints) and self.fingerprints[index] == fingerprint:
+            if self.keys[index].tobytes() == key:
+                break
+            index += 1
+        else:
+            return None
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        row = np.zeros(ACTION_COUNT, dtype=np.float32)
+        row[self.action_ids[start:end]] = self.cells[start:end]
+        return row
+
+    def _row(self, state):
+        """Q-values of a state, or None if it has none"""
+        row = self.dirty.get(state)
+        if row is not None:
+            return row
+        if state in self.cache:
+            self.cache.move_to_end(state)
+            self.hits += 1
+            return self.cache[state]
+        self.misses += 1
+        row = self._file_row(state)
+        self.cache[state] = row
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return row
+
+    def __len__(self):
+        return len(self.fingerprints) + self.new_states
+
+    def __contains__(self, state):
+        return self._row(state) is not None
+
+    def get(self, state, action_id, default=0.0):
+        row = self._row(state)
+        if row is None:
+            return default
+        return float(row[action_id])
+
+    def set(self, state, action_id, value):
+        row = self.dirty.get(state)
+        if row is None:
+            row = self._row(state)
+            if row is None:
+                self.new_states += 1
+                row = np.zeros(ACTION_COUNT, dtype=np.float32)
+            self.cache.pop(state, None)
+            self.dirty[state] = row
+        if self.touched is not None:
+            self.touched.add(state)
+        row[action_id] = value
+
+    def start_episode(self):
+        """Nothing to do, mapped tables aren't bounded"""
+
+    def track_touched(self):
+        self.touched = set()
+
+    def take_touched(self):
+        rows = {state: self._row(state).copy() for state in self.touched}
+        self.touched = set()
+        return rows
+
+    def snapshot(self):
+        """Copy that shares the mapped file and copies the rows written since, see QTable.snapshot"""
+        copy = object.__new__(MappedQTable)
+        copy.__dict__.update(self.__dict__)
+        copy.cache = OrderedDict()
+        copy.dirty = {state: row.copy() for state, row in self.dirty.items()}
+        copy.touched = None
+        return copy
+
+    def values_for(self, state, action_ids):
+        row = self._row(state)
+        if row is None:
+            return np.zeros(len(action_ids), dtype=np.float32)
+        return row[action_ids]
+
+    def max_value(self, state, action_ids):
+        if len(action_ids) == 0:
+            return 0.0
+        return float(self.values_for(state, action_ids).max())
+
+    def iter_rows(self):
+        """(state, row) for every state in the file plus the ones written since"""
+        seen = set()
+        for index in range(len(self.fingerprints)):
+            state = int.from_bytes(self.keys[index].tobytes(), 'little')
+            if state in self.dirty:
+                seen.add(state)
+                yield state, self.dirty[state]
+                continue
+            start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+            row = np.zeros(ACTION_COUNT, dtype=np.float32)
+            row[self.action_ids[start:end]] = self.cells[start:end]
+            yield state, row
+        for state, row in self.dirty.items():
+            if state not in seen:
+                yield state, row
+
+    def save(self, file_path=None):
+        """Folds the in-memory writes into a fresh file and maps that instead"""
+        file_path = file_path or self.file_path
+        write_mapped_q_table(self, file_path)
+        if file_path == self.file_path:
+            self._raw = None
+            self._open()
+            self.dirty = {}
+            self.cache.clear()
+            self.new_states = 0
@@ -0,0 +1,265 @@
+import collections
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import time
+
+from ai_game import log_levels
+from ai_game.board_evaluation import evaluate_board
+from ai_game.log_levels import move_message
+from ai_game.simple_ai import random_move
+
+'''Monte Carlo tree search opponent
+
+The tree lives in the main process and grows one action at a time with
+Game.push/pop, like ai_game.search_ai. Every round picks a batch of leaves,
+counting each pick as a lost visit right away (a virtual loss) so the
+batch spreads out instead of piling onto one leaf, then plays them all out
+with SimpleAI's random moves on a pool of worker processes (leaf
+parallelization) and adds the results up the tree. The root is pickled
+once per search and one batch more than there are workers is kept in
+flight, so the main process selects the next batch while the workers play
+out the last ones. More workers should mean more rollouts in the same
+time, rollouts_per_second says how many a search actually got.'''
+
+
+def side(turn):
+    return "white" if turn.startswith("white") else "black"
+
+
+def rollout(game, max_moves):
+    """Plays random moves to the end of the game and takes them all back, returns the winning color or None
+
+    Games still going after max_moves go to whoever is ahead on material.
+    """
+    pushed = 0
+    try:
+        while not game.game_over and pushed < max_moves:
+            move = random_move(game)
+            if move is None:
+                break
+            game.push(move)
+            pushed += 1
+        if game.game_over:
+            # Whoever still has a king won
+            return next((color for color in ("white", "black") if game.board.king_positions[color]), None)
+        score = evaluate_board(game)
+        return "white" if score > 0 else "black" if score < 0 else None
+    finally:
+        for move in range(pushed):
+            game.pop()
+
+
+def _rollout_task(task):
+    """Worker side of a batch: unpickles the root position, then plays out every leaf path from it
+
+    Returns the winners and how long the batch took.
+    """
+    started = time.perf_counter()
+    root, paths, max_moves, seed = task
+    random.seed(seed)
+    log_levels.level = log_levels.SUMMARY  # Keeps the rollouts' captures from printing
+    game = pickle.loads(root)
+    game.quiet = True
+    results = []
+    for path in paths:
+        for move in path:
+            game.push(move)
+        results.append(rollout(game, max_moves))
+        for move in path:
+            game.pop()
+    return results, time.perf_counter() - started
+
+
+class Node:
+    def __init__(self, move, parent, color, moves):
+        self.move = move
+        self.parent = parent
+        self.color = color  # Who played move, wins are counted for them
+        self.untried = moves  # Legal moves without a child yet
+        self.children = []
+        self.visits = 0
+        self.wins = 0.0
+
+    def best_child(self, exploration):
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child: child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits))
+
+
+class MCTSAI:
+    """UCT search with rollouts on a worker pool
+
+    Each action gets time_limit seconds, or exactly rollouts rollouts if
+    that's set, which makes strength independent of how busy the machine
+    is. workers=1 plays the rollouts out in this process. The subtree under
+    the chosen action is kept, so the next action of the same turn starts
+    from everything already searched below it.
+    """
+    def __init__(self, game, player_name, time_limit=1.0, rollouts=None, workers=None, exploration=1.4, batch_per_worker=8,
+                 max_rollout_moves=300):
+        self.game = game
+        self.player_name = player_name
+        self.time_limit = time_limit
+        self.rollout_budget = rollouts
+        self.workers = workers or os.cpu_count()
+        self.exploration = exploration
+        self.batch_per_worker = batch_per_worker
+        self.max_rollout_moves = max_rollout_moves
+        self.pool = None
+        self.root = None
+        self.root_key = None  # Game.zobrist_hash of the position the kept root belongs to
+        self.rollouts = 0  # Of the last search
+        self.rollouts_per_second = 0.0
+        self.rollout_seconds = None  # Running average of one rollout's time on a worker, sizes the batches near the deadline
+
+    def make_move(self):
+        """Plays the AI's whole turn, one searched action at a time"""
+        color = side(self.game.turn)
+        while not self.game.game_over and side(self.game.turn) == color:
+            move = self.best_move()
+            if move is None:
+                self.game.advance_turn()  # No farm fits next to the king, same as the other AIs passing
+                break
+            self.game.push(move)
+        self.game.undo_stack.clear()  # The moves are real, nothing should take them back
+
+    def best_move(self):
+        """The most visited action after searching the current position, or None if there is none"""
+        game = self.game
+        moves = game.legal_moves()
+        if len(moves) <= 1:
+            self.root = None
+            return moves[0] if moves else None
+        root = self.root if self.root is not None and self.root_key == game.zobrist_hash() else None
+        if root is None:
+            root = Node(None, None, None, moves)
+        root.parent = None
+
+        started = time.perf_counter()
+        deadline = started + self.time_limit
+        self.rollouts = 0
+        saved_level, saved_quiet = log_levels.level, game.quiet
+        log_levels.level = log_levels.SUMMARY  # Keeps the searched and played out moves from printing
+        game.quiet = True
+        try:
+            if self.workers == 1:
+                self._search_here(root, deadline)
+            else:
+                self._search_pool(root, deadline)
+        finally:
+            log_levels.level = saved_level
+            game.quiet = saved_quiet
+        elapsed = time.perf_counter() - started
+        self.rollouts_per_second = self.rollouts / elapsed if elapsed else 0.0
+        move_message(f"{self.player_name}: {self.rollouts} rollouts, {self.rollouts_per_second:.0f}/s on {self.workers} workers")
+
+        best = max(root.children, key=lambda child: child.visits)
+        # Keep the subtree for the next action of this turn
+        game.push(best.move)
+        self.root, self.root_key = best, game.zobrist_hash()
+        game.pop()
+        return best.move
+
+    def _budget_left(self, started, deadline):
+        """Whether to start more rollouts, with started already under way"""
+        if self.rollout_budget:
+            return started < self.rollout_budget
+        return started == 0 or time.perf_counter() < deadline
+
+    def _batch_size(self, started, deadline):
+        if self.rollout_budget:
+            return min(self.batch_per_worker, self.rollout_budget - started)
+        if self.rollout_seconds is None:
+            return self.batch_per_worker
+        # A batch sent now may wait for the one queued ahead of it, so it only gets half the time left
+        fits = int((deadline - time.perf_counter()) / (2 * self.rollout_seconds))
+        return max(1, min(self.batch_per_worker, fits))
+
+    def _select(self, root):
+        """Walks down by UCT to a leaf, expanding one new child, and returns it with the moves leading to it
+
+        Every node on the way gets its visit now, counted as a loss until
+        the rollout result comes back.
+        """
+        game = self.game
+        node = root
+        path = []
+        try:
+            node.visits += 1
+            while not node.untried and node.children:
+                node = node.best_child(self.exploration)
+                game.push(node.move)
+                path.append(node.move)
+                node.visits += 1
+            if node.untried and not game.game_over:
+                move = node.untried.pop(random.randrange(len(node.untried)))
+                color = side(game.turn)
+                game.push(move)
+                path.append(move)
+                child = Node(move, node, color, game.legal_moves())
+                node.children.append(child)
+                node = child
+                node.visits += 1
+            return node, path
+        finally:
+            for move in path:
+                game.pop()
+
+    def _search_here(self, root, deadline):
+        """One rollout at a time in this process, checking the budget after each"""
+        game = self.game
+        while self._budget_left(self.rollouts, deadline):
+            node, path = self._select(root)
+            for move in path:
+                game.push(move)
+            winner = rollout(game, self.max_rollout_moves)
+            for move in path:
+                game.pop()
+            self._backpropagate(node, winner)
+            self.rollouts += 1
+
+    def _search_pool(self, root, deadline):
+        """Keeps workers + 1 batches in flight, selecting a new one each time the oldest comes back
+
+        No batch is sent once the budget is used up, the ones in flight are
+        still waited for and counted.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        root_state = pickle.dumps(self.game)
+        in_flight = collections.deque()
+        started = 0
+        while True:
+            while len(in_flight) <= self.workers and self._budget_left(started, deadline):
+                leaves = [self._select(root) for leaf in range(self._batch_size(started, deadline))]
+                task = (root_state, [path for node, path in leaves], self.max_rollout_moves, random.randrange(2 ** 32))
+                in_flight.append((leaves, self.pool.apply_async(_rollout_task, (task,))))
+                started += len(leaves)
+            if not in_flight:
+                break
+            leaves, result = in_flight.popleft()
+            winners, seconds = result.get()
+            if self.rollout_seconds is None:
+                self.rollout_seconds = seconds / len(leaves)
+            else:
+                # Rollout lengths vary a lot, one batch says little on its own
+                self.rollout_seconds += 0.1 * (seconds / len(leaves) - self.rollout_seconds)
+            for (node, path), winner in zip(leaves, winners):
+                self._backpropagate(node, winner)
+            self.rollouts += len(leaves)
+
+    def _backpropagate(self, node, winner):
+        while node is not None:
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.color:
+                node.wins += 1.0
+            node = node.parent
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,186 @@
+import os
+import struct
+import numpy as np
+
+from ai_game.ai_logic import Game
+from ai_game.ai_pieces import Piece
+from ai_game.q_table import NO_ACTION, action_index, index_action
+from ai_game.state_encoding import CODE_PIECES, TURNS, TURN_INDEXES
+from ai_game.game_records import PLAYERS
+
+'''Games stored as move lists, with a full position every so often
+
+A .moves file is a header followed by one block per game:
+    GAME_HEADER   episode, move count, keyframe interval and count, finished
+    moves         uint16[move count], padded to 8 bytes
+    keyframes     KEYFRAME[keyframe count]
+Move codes are the Q-table action ids for pawn moves, plus the codes below
+for everything else a player can do. Keyframe k holds the whole game state
+after (k + 1) * interval moves, so any position is at most interval - 1
+moves away from one. <file>.idx lists the offset of every game block.'''
+
+MAGIC = b'TMV1'
+HEADER = struct.Struct('<4s4x')
+GAME_MAGIC = b'GAME'
+GAME_HEADER = struct.Struct('<4siIHHB7x')
+KEYFRAME = struct.Struct('<I32sBBBBHHBB2x')
+
+BUY_ACTION = NO_ACTION + 1
+END_TURN = NO_ACTION + 2
+DRAW = NO_ACTION + 3  # The agent gave up on finding a move
+PASS = NO_ACTION + 4  # Initial placement turn without a piece placed
+PLACE_KING_OFFSET = 576
+PLACE_FARM_OFFSET = 640
+
+
+def move_code(move):
+    kind = move[0]
+    if kind == 'buy_action':
+        return BUY_ACTION
+    if kind == 'end_turn':
+        return END_TURN
+    if kind == 'draw':
+        return DRAW
+    if kind == 'pass':
+        return PASS
+    if kind == 'place_king':
+        return PLACE_KING_OFFSET + move[1] * 8 + move[2]
+    if kind == 'place_farm':
+        return PLACE_FARM_OFFSET + move[1] * 8 + move[2]
+    return action_index(move)
+
+
+def code_move(code, board):
+    """Move tuple for a code, turret shots need the board from before the shot"""
+    if code < NO_ACTION:
+        return index_action(code, board)
+    if code >= PLACE_FARM_OFFSET:
+        return ('place_farm',) + divmod(code - PLACE_FARM_OFFSET, 8)
+    if code >= PLACE_KING_OFFSET:
+        return ('place_king',) + divmod(code - PLACE_KING_OFFSET, 8)
+    return {BUY_ACTION: ('buy_action',), END_TURN: ('end_turn',), DRAW: ('draw',), PASS: ('pass',)}[code]
+
+
+def pack_keyframe(game, move_index):
+    return KEYFRAME.pack(
+        move_index,
+        game.board.packed.to_bytes(32, 'little'),
+        TURN_INDEXES[game.turn],
+        game.initial_phase,
+        min(game.actions["white"], 255),
+        min(game.actions["black"], 255),
+        min(game.action_points["white"], 65535),
+        min(game.action_points["black"], 65535),
+        game.game_over,
+        PLAYERS.index(game.winner) if game.winner in PLAYERS else 3,
+    )
+
+
+def pack_game(moves, keyframes, interval, episode=None, finished=True):
+    """One game block from its move codes and packed keyframes"""
+    codes = np.array(moves, dtype='<u2').tobytes()
+    return b''.join([
+        GAME_HEADER.pack(GAME_MAGIC, -1 if episode is None else episode, len(moves), interval, len(keyframes), finished),
+        codes,
+        b'\0' * (-len(codes) % 8),
+        *keyframes,
+    ])
+
+
+def write_header(file):
+    file.write(HEADER.pack(MAGIC))
+
+
+def _restore(keyframe):
+    """Game in the state a keyframe was taken in"""
+    _, board, turn, initial_phase, actions_white, actions_black, points_white, points_black, game_over, winner = keyframe
+    game = Game()
+    packed = int.from_bytes(board, 'little')
+    square = 0
+    while packed:
+        code = packed & 0xF
+        if code:
+            color, piece_type = CODE_PIECES[code]
+            game.board.set_piece_at(square // 8, square % 8, Piece(color, piece_type))
+        packed >>= 4
+        square += 1
+    game.turn = TURNS[turn]
+    game.initial_phase = bool(initial_phase)
+    game.actions = {"white": actions_white, "black": actions_black}
+    game.action_points = {"white": points_white, "black": points_black}
+    game.game_over = bool(game_over)
+    game.winner = PLAYERS[winner] if winner < len(PLAYERS) else None
+    return game
+
+
+def apply_move_code(game, code):
+    """Plays one recorded move with the Game rules"""
+    if code == DRAW:
+        game.game_over = True
+        game.winner = None
+    elif code == PASS:
+        game.advance_turn()
+    else:
+        game._apply_move(code_move(code, game.board))
+
+
+class GameReplay:
+    """Random access to the positions of every game in a .moves file"""
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.data = np.memmap(file_path, dtype=np.uint8, mode='r')
+        if self.data[:HEADER.size].tobytes() != HEADER.pack(MAGIC):
+            raise ValueError(f"{file_path} is not a move log")
+        self.offsets = []
+        index_path = file_path + '.idx'
+        if os.path.exists(index_path):
+            self.offsets = [int(offset) for offset in np.fromfile(index_path, dtype='<u8')]
+        # Games written after the index was last saved, e.g. before a crash, are found by walking the blocks
+        offset = self._block_end(self.offsets[-1]) if self.offsets else HEADER.size
+        while offset + GAME_HEADER.size <= len(self.data):
+            end = self._block_end(offset)
+            if end > len(self.data):
+                break
+            self.offsets.append(offset)
+            offset = end
+
+    def _header(self, game_index):
+        offset = self.offsets[game_index]
+        return offset, GAME_HEADER.unpack(self.data[offset:offset + GAME_HEADER.size].tobytes())
+
+    def _block_end(self, offset):
+        magic, _, move_count, _, keyframe_count, _ = GAME_HEADER.unpack(self.data[offset:offset + GAME_HEADER.size].tobytes())
+        if magic != GAME_MAGIC:
+            raise ValueError(f"Corrupt game block at byte {offset} of {self.file_path}")
+        return offset + GAME_HEADER.size + (move_count * 2 + 7) // 8 * 8 + keyframe_count * KEYFRAME.size
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def game_info(self, game_index):
+        _, (_, episode, move_count, interval, keyframe_count, finished) = self._header(game_index)
+        return {'episode': episode, 'moves': move_count, 'keyframe_interval': interval, 'finished': bool(finished)}
+
+    def moves(self, game_index):
+        """The game's move codes as an array"""
+        offset, (_, _, move_count, _, _, _) = self._header(game_index)
+        start = offset + GAME_HEADER.size
+        return self.data[start:start + move_count * 2].view('<u2')
+
+    def position(self, game_index, move_number=None):
+        """The game after its first move_number moves (all of them if None)"""
+        offset, (_, _, move_count, interval, keyframe_count, _) = self._header(game_index)
+        if move_number is None:
+            move_number = move_count
+        if not 0 <= move_number <= move_count:
+            raise IndexError(f"Game {game_index} only has {move_count} moves")
+        keyframe_number = min(move_number // interval, keyframe_count)
+        if keyframe_number:
+            keyframe_start = offset + GAME_HEADER.size + (move_count * 2 + 7) // 8 * 8 + (keyframe_number - 1) * KEYFRAME.size
+            keyframe = KEYFRAME.unpack(self.data[keyframe_start:keyframe_start + KEYFRAME.size].tobytes())
+            game, replayed = _restore(keyframe), keyframe[0]
+        else:
+            game, replayed = Game(), 0
+        for code in self.moves(game_index)[replayed:move_number]:
+            apply_move_code(game, int(code))
+        return game
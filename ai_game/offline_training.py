@@ -0,0 +1,133 @@
+from collections import namedtuple
+import numpy as np
+
+from ai_game.game_records import MOVE, OUTCOMES, read_game_records
+from ai_game.state_encoding import BOARD_BITS
+from ai_game.symmetry import canonicalize_state, ACTION_ID_MAPS
+from ai_game.q_table import ALL_ACTION_IDS, NO_ACTION
+
+'''Q-learning from games that were already played
+
+The binary log (a DataCollector file ending in .bin) keeps every
+QLearningAI update as the state before the move, the action, the
+cumulative reward it was given and the state after it. That's everything
+update_q_value looks at, so the same updates can be run again over the
+logged games with another alpha or gamma, as often as we like, without
+playing a single game.
+
+Q-values never go below zero here (rewards are all positive and the table
+starts at 0), so the max over the next state's valid moves is the max over
+its whole row, and the valid moves don't need to be logged.'''
+
+# One entry per logged update, states are numbered and listed in states
+Transitions = namedtuple('Transitions', ['states', 'state_ids', 'action_ids', 'rewards', 'next_ids', 'terminal'])
+
+IN_PROGRESS = OUTCOMES.index('in_progress')
+
+
+def _keys(records):
+    """The state keys before and after every record, as Python ints"""
+    boards = [int.from_bytes(board.tobytes(), 'little') for board in records['board']]
+    states = [int.from_bytes(state.tobytes(), 'little') for state in records['state']]
+    turns = records['turn'].tolist()
+    actions = records['actions'].tolist()
+    action_points = records['action_points'].tolist()
+    next_states = [board
+                   | turn << BOARD_BITS
+                   | white_actions << (BOARD_BITS + 3)
+                   | black_actions << (BOARD_BITS + 11)
+                   | white_points << (BOARD_BITS + 19)
+                   | black_points << (BOARD_BITS + 27)
+                   for board, turn, (white_actions, black_actions), (white_points, black_points)
+                   in zip(boards, turns, actions, action_points)]
+    return states, next_states
+
+
+def load_transitions(file_paths, use_symmetry=True):
+    """Reads the QLearningAI updates out of one or more binary logs
+
+    Rows without a state (SimpleAI moves, logs written before the state was
+    logged) are skipped. With use_symmetry the states and actions are
+    mapped to their symmetry class like QLearningAI.q_keys does.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    numbers = {}
+    state_ids, action_ids, rewards, next_ids, terminal = [], [], [], [], []
+    for file_path in file_paths:
+        records = read_game_records(file_path)
+        if 'state' not in records.dtype.names:
+            raise ValueError(f"{file_path} is a version 1 log, it has no states to learn from")
+        records = records[(records['kind'] == MOVE) & records['state'].any(axis=1) & (records['action_id'] >= 0)]
+        states, next_states = _keys(records)
+        actions = records['action_id'].astype(np.intp)
+        if use_symmetry:
+            mapped = []
+            for index, state in enumerate(states):
+                states[index], transform = canonicalize_state(state)
+                mapped.append(ACTION_ID_MAPS[transform][actions[index]])
+            actions = np.array(mapped, dtype=np.intp)
+            next_states = [canonicalize_state(state)[0] for state in next_states]
+        state_ids.append(np.fromiter((numbers.setdefault(state, len(numbers)) for state in states), dtype=np.intp, count=len(states)))
+        next_ids.append(np.fromiter((numbers.setdefault(state, len(numbers)) for state in next_states), dtype=np.intp, count=len(states)))
+        action_ids.append(actions)
+        rewards.append(records['cumulative_reward'].astype(np.float64))
+        # A win or a draw leaves no valid moves, so nothing is added for the next state
+        terminal.append(records['outcome'] != IN_PROGRESS)
+    return Transitions(list(numbers), np.concatenate(state_ids), np.concatenate(action_ids), np.concatenate(rewards),
+                       np.concatenate(next_ids), np.concatenate(terminal))
+
+
+def train_offline(q_table, transitions, alpha=0.1, gamma=0.9, sweeps=10, batch_size=65536, seed=None, shuffle=True):
+    """Runs the update_q_value rule over the transitions sweeps times, writing the results into q_table
+
+    Every sweep goes through the transitions in a new random order, or in
+    log order with shuffle=False, a batch at a time. A batch sees the
+    Q-values as they were when it started, and a (state, action) it holds n
+    times moves towards the mean of its targets as far as n updates in a
+    row would. One sweep with batch_size=1 and shuffle=False over a log
+    written into an empty table gives back the table that wrote it.
+    Returns the mean |change in Q| of every sweep.
+    """
+    rng = np.random.default_rng(seed)
+    states = transitions.states
+    state_count = len(states)
+    # Every (state, action) the log updates gets a slot in q, numbered by pair id
+    pair_keys, pair_ids = np.unique(transitions.state_ids * len(ALL_ACTION_IDS) + transitions.action_ids, return_inverse=True)
+    pair_states, pair_actions = np.divmod(pair_keys, len(ALL_ACTION_IDS))
+    q = np.empty(len(pair_keys))
+    # Actions the log never updates keep their value, so only their max per state is needed
+    other_max = np.zeros(state_count)
+    first_pairs = np.searchsorted(pair_states, np.arange(state_count + 1))
+    for state_id, state in enumerate(states):
+        if state not in q_table:
+            q[first_pairs[state_id]:first_pairs[state_id + 1]] = 0.0
+            continue
+        row = np.array(q_table.values_for(state, ALL_ACTION_IDS), dtype=np.float64)
+        logged = pair_actions[first_pairs[state_id]:first_pairs[state_id + 1]]
+        q[first_pairs[state_id]:first_pairs[state_id + 1]] = row[logged]
+        row[logged] = 0.0
+        row[NO_ACTION] = 0.0  # Never a valid move
+        other_max[state_id] = row.max()
+
+    movable = pair_actions != NO_ACTION  # The draw's update, not a move the next state could pick
+    changes = []
+    for sweep in range(sweeps):
+        order = rng.permutation(len(pair_ids)) if shuffle else np.arange(len(pair_ids))
+        total_change = 0.0
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            state_max = other_max.copy()
+            np.maximum.at(state_max, pair_states[movable], q[movable])
+            next_q = np.where(transitions.terminal[batch], 0.0, state_max[transitions.next_ids[batch]])
+            targets = transitions.rewards[batch] + gamma * next_q
+            pairs, inverse, counts = np.unique(pair_ids[batch], return_inverse=True, return_counts=True)
+            mean_targets = np.bincount(inverse, weights=targets) / counts
+            step = (1.0 - (1.0 - alpha) ** counts) * (mean_targets - q[pairs])
+            q[pairs] += step
+            total_change += np.abs(step).sum()
+        changes.append(float(total_change / max(len(order), 1)))
+
+    for state_id, action_id, value in zip(pair_states.tolist(), pair_actions.tolist(), q.tolist()):
+        q_table.set(states[state_id], action_id, value)
+    return changes
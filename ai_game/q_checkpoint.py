@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+
+from ai_game.q_table import append_delta_log, delta_log_paths, write_q_table
+
+'''Incremental Q-table checkpoints
+
+Instead of rewriting the whole table, a checkpoint appends just the rows
+written since the previous one to <table file>.log, so it costs as much as
+the learning that happened in between. load_q_table replays the logs on top
+of the table file. Once the log gets big it's sealed as <table file>.log.old
+and a snapshot of the table being trained, which already holds every logged
+row, replaces the table file on a background thread while new checkpoints
+go to a fresh log. Nothing gets read back from disk, and rows a bounded
+table has evicted since are left out.'''
+
+
+class QTableCheckpointer:
+    def __init__(self, q_table, file_path='qtable/q_table.pkl', interval=5.0, compact_bytes=32 * 1024 * 1024):
+        self.q_table = q_table
+        self.file_path = file_path
+        self.interval = interval  # Seconds between checkpoints, the most learning a crash can lose
+        self.compact_bytes = compact_bytes
+        self.sealed_log_path, self.log_path = delta_log_paths(file_path)
+        self.last_checkpoint = time.monotonic()
+        self.compactor = None
+        q_table.track_touched()
+        if not os.path.exists(file_path):
+            # The log only holds rows, the table file is what remembers the table's type and settings
+            write_q_table(q_table, file_path)
+
+    def maybe_checkpoint(self):
+        """Checkpoints if the interval has passed, cheap enough to call after every move"""
+        if time.monotonic() - self.last_checkpoint >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Appends the rows written since the last checkpoint to the log"""
+        self.last_checkpoint = time.monotonic()
+        rows = self.q_table.take_touched()
+        if rows:
+            append_delta_log(rows, self.log_path)
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """Seals the log and writes a snapshot of the table over the table file on a background thread"""
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+        rows = self.q_table.take_touched()
+        if rows:
+            append_delta_log(rows, self.log_path)  # So the snapshot holds exactly the file plus the logs
+        if os.path.exists(self.log_path):
+            if os.path.exists(self.sealed_log_path):
+                # Left over from a crash, the snapshot covers both so they get sealed together
+                with open(self.sealed_log_path, 'ab') as sealed, open(self.log_path, 'rb') as log:
+                    sealed.write(log.read())
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.sealed_log_path)
+        elif not os.path.exists(self.sealed_log_path):
+            return
+        self.compactor = threading.Thread(target=self._compact, args=(self.q_table.snapshot(),))
+        self.compactor.start()
+
+    def _compact(self, snapshot):
+        write_q_table(snapshot, self.file_path)
+        os.remove(self.sealed_log_path)
+
+    def close(self):
+        """Last checkpoint, then waits for a running compaction to finish
+
+        A bounded table is compacted on the way out too, so states it
+        evicted don't stay in the file and logs to come back next load.
+        """
+        self.checkpoint()
+        if getattr(self.q_table, 'max_states', None) is not None:
+            if self.compactor is not None:
+                self.compactor.join()
+            self.compact()
+        if self.compactor is not None:
+            self.compactor.join()
@@ -1,44 +1,58 @@
-import os
-import pickle
 import random
 import numpy as np
 
 from ai_game.ai_pieces import PieceType, Piece
 from ai_game.ai_logic import Game
+from ai_game.ai_board import iter_squares
 from ai_game.data_collection import DataCollector
 from ai_game.board_evaluation import evaluate_board
+from ai_game.state_encoding import encode_state
+from ai_game.symmetry import canonicalize_state, ACTION_ID_MAPS
+from ai_game.q_table import ALL_ACTION_IDS, NO_ACTION, action_index, load_q_table, new_q_table, save_q_table
+
+MOVE_ACTION_IDS = ALL_ACTION_IDS[:NO_ACTION]  # Every id a valid move can have
 
 
 class QLearningAI:
-    def __init__(self, game, player_name, alpha=0.1, gamma=0.9, epsilon=0.1, epsilon_decay=0.995, min_epsilon=0.01, episode=1):
+    def __init__(self, game, player_name, alpha=0.1, gamma=0.9, epsilon=0.1, epsilon_decay=0.995, min_epsilon=0.01, episode=1, use_symmetry=True, q_storage=None, replay=None):
         self.game = game
-        self.data_collector = DataCollector()
+        self.data_collector = DataCollector.shared()
         self.player_name = player_name
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon  # Exploration rate
         self.epsilon_decay = epsilon_decay  # Decay rate
         self.min_epsilon = min_epsilon  # Minimum value
-        self.q_table = {}
+        self.q_storage = q_storage  # 'float32', 'float16' or 'int16', None keeps whatever a loaded table uses
+        self.q_table = new_q_table(q_storage or 'float32')
+        self.use_symmetry = use_symmetry  # Share Q-values between rotated/mirrored positions
+        self.replay = replay  # An ai_game.replay_buffer.ReplayBuffer to learn from minibatches of instead of every move
         self.episode = episode
         self.turn_count = 0 
         self.previous_board_evaluation = evaluate_board(self.game)
         self.cumulative_reward = 0
 
     def load_q_table(self, file_path='qtable/q_table.pkl'):
-        if os.path.exists(file_path):
-            with open(file_path, 'rb') as file:
-                self.q_table = pickle.load(file)
-        else:
-            self.q_table = {}
+        self.q_table = load_q_table(file_path, storage=self.q_storage, canonical=self.use_symmetry)
 
     def save_q_table(self, file_path='qtable/q_table.pkl'):
-        with open(file_path, 'wb') as file:
-            pickle.dump(self.q_table, file)
+        save_q_table(self.q_table, file_path)
 
     def get_state(self):
-        # Need this to analyze board state
-        return tuple([tuple(row) for row in self.game.board.board])
+        # Need this to analyze board state, packs the pieces, turn and action counts into one int
+        return encode_state(self.game)
+
+    def q_keys(self, state, actions):
+        """Q-table state and action ids for some actions, mapped to the symmetry class representative"""
+        action_ids = np.fromiter((action_index(action) for action in actions), dtype=np.intp, count=len(actions))
+        if not self.use_symmetry:
+            return state, action_ids
+        canonical_state, transform = canonicalize_state(state)
+        return canonical_state, ACTION_ID_MAPS[transform][action_ids]
+
+    def q_action_key(self, state, action):
+        table_state, action_ids = self.q_keys(state, [action])
+        return table_state, action_ids[0]
 
     def choose_action(self, state, valid_moves):
         '''USES THE Q TABLE TO FIND BEST MOVE'''
@@ -54,25 +68,45 @@ class QLearningAI:
             exploration = True
         else:
             # Exploitation: Choose the action with the highest Q-value
-            q_values = [self.q_table.get((state, action), 0) for action in valid_moves]
-            max_q = max(q_values)
-            max_q_actions = [action for action, q in zip(valid_moves, q_values) if q == max_q]
-            action = random.choice(max_q_actions)
+            q_values = self.q_table.values_for(*self.q_keys(state, valid_moves))
+            max_q_actions = np.flatnonzero(q_values == q_values.max())
+            action = valid_moves[random.choice(max_q_actions)]
         return action, exploration
 
     def update_q_value(self, state, action, reward, next_state, next_valid_moves, cumulative_reward):
-        current_q = self.q_table.get((state, action), 0)
+        if not self.use_symmetry:
+            self.q_table.canonical = False  # Raw states from here on, loading with symmetry re-keys them
+        table_state, action_id = self.q_action_key(state, action)
+        if self.replay is not None:
+            self.replay.add(table_state, action_id, cumulative_reward, self.q_keys(next_state, [])[0], not next_valid_moves)
+            return self.replay_update() if self.replay.ready() else 0.0
+        current_q = self.q_table.get(table_state, action_id)
         if next_valid_moves:
-            next_q = max([self.q_table.get((next_state, next_action), 0) for next_action in next_valid_moves])
+            next_q = self.q_table.max_value(*self.q_keys(next_state, next_valid_moves))
         else:
             next_q = 0
 
         new_q = current_q + self.alpha * (cumulative_reward + self.gamma * next_q - current_q)
         q_value_change = abs(new_q - current_q)
-        self.q_table[(state, action)] = new_q
+        self.q_table.set(table_state, action_id, new_q)
 
         return q_value_change
 
+    def replay_update(self):
+        """Applies update_q_value's rule to a minibatch from the replay buffer, returns the mean change
+
+        Q-values never go below zero (rewards are all positive), so the max
+        over the next state's whole row is the max over its valid moves.
+        """
+        states, action_ids, rewards, next_states, terminal = self.replay.sample()
+        next_q = np.array([0.0 if done else self.q_table.max_value(next_state, MOVE_ACTION_IDS)
+                           for next_state, done in zip(next_states, terminal)])
+        current_q = np.array([self.q_table.get(state, action_id) for state, action_id in zip(states, action_ids.tolist())])
+        new_q = current_q + self.alpha * (rewards + self.gamma * next_q - current_q)
+        for state, action_id, value in zip(states, action_ids.tolist(), new_q.tolist()):
+            self.q_table.set(state, action_id, value)
+        return float(np.abs(new_q - current_q).mean())
+
     def calculate_reward(self, previous_evaluation, current_evaluation, action):
         '''checks how much the action changed the board state eval'''
         if action and action[0] == 'fire_turret':
@@ -98,6 +132,9 @@ class QLearningAI:
             reward = 500
 
         q_value_change = self.update_q_value(state, action, reward, self.get_state(), self.find_valid_moves(), self.cumulative_reward)
+        self.data_collector.add_move_stats(reward, q_value_change, exploration)
+        if not self.data_collector.wants_row():
+            return  # Sampled out, don't pay for building the row
 
         if action is not None:
             action_params = {'from': (action[1], action[2]) if action and len(action) > 2 else None}
@@ -112,10 +149,11 @@ class QLearningAI:
         loser = "Player 2" if winner == "Player 1" else "Player 1" if winner else None
 
         self.data_collector.log_data(
-            self.data_collector.serialize_game_state(self.game),
+            self.data_collector.snapshot_game_state(self.game),
             self.data_collector.serialize_action(action[0], action_params) if action else {'action': 'none', 'parameters': {}},
             outcome, current_board_evaluation, reward, winner, loser, self.episode, self.turn_count,
-            self.q_table.get((state, action), 0) if action else None, q_value_change, exploration, self.game.turn, self.cumulative_reward
+            self.q_table.get(*self.q_action_key(state, action)) if action else None, q_value_change, exploration, self.game.turn, self.cumulative_reward,
+            action_id=action_index(action), state=state
         )
 
 
@@ -123,15 +161,18 @@ class QLearningAI:
     def perform_action(self, action):
         '''performs the action :)'''
         color = self.get_current_color()
+        already_over = self.game.game_over  # log_action replays the winning shot, it was logged when it was fired
         if action[0] == 'place_pawn':
             self.game.board.place_piece(action[1], action[2], PieceType.PAWN, color)
             self.game.actions[color] -= 1
         elif action[0] == 'upgrade_pawn':
-            self.game.board.board[action[1]][action[2]] = Piece(color, action[3])
+            self.game.board.set_piece_at(action[1], action[2], Piece(color, action[3]))
             self.game.actions[color] -= 1
         elif action[0] == 'fire_turret':
             self.game.valid_targets = self.game.find_valid_targets_for_turret(action[1], action[2])
             self.game.fire_turret(action[1], action[2], action[3], action[4])
+        if not already_over:
+            self.data_collector.log_move(self.game, action)
 
 
     def make_move(self):
@@ -160,6 +201,8 @@ class QLearningAI:
             self.turn_count += 1
         self.end_turn_with_farm_count(current_color)
         self.game.advance_turn()
+        if not self.game.game_over:
+            self.data_collector.log_move(self.game, ('end_turn',))
         self.cumulative_reward = 0
 
     def buy_actions(self):
@@ -168,6 +211,7 @@ class QLearningAI:
         while self.game.action_points[color] >= 3:
             self.game.action_points[color] -= 3
             self.game.actions[color] += 1
+            self.data_collector.log_move(self.game, ('buy_action',))
 
     def get_current_color(self):
         return "white" if self.game.turn.lower().startswith("white") else "black"
@@ -190,6 +234,7 @@ class QLearningAI:
             row, col = random.randint(0, 7), random.randint(0, 7)
             if self.game.board.is_valid_initial_placement(row, col) and self.game.board.place_piece(row, col, PieceType.KING, color):
                 placed = True
+                self.data_collector.log_move(self.game, ('place_king', row, col))
                 self.place_farm_next_to_king(row, col, color)
                 self.game.advance_turn()
 
@@ -202,7 +247,10 @@ class QLearningAI:
         for row, col in adjacent_positions:
             if self.game.board.is_valid_position(row, col) and self.game.board.get_piece_at(row, col) is None:
                 self.game.board.place_piece(row, col, PieceType.FARM, color)
+                self.data_collector.log_move(self.game, ('place_farm', row, col))
                 break  # NEED THIS TO ONLY PLACE 1 FARM
+        else:
+            self.data_collector.log_move(self.game, ('pass',))
         self.game.advance_turn()
 
     def place_farm(self, color):
@@ -222,30 +270,19 @@ class QLearningAI:
         valid_moves = []
 
         # Find all valid pawn placement positions
-        for row in range(8):
-            for col in range(8):
-                if (self.game.board.is_adjacent_to_piece(row, col, color) and 
-                    self.game.board.is_valid_position(row, col) and 
-                    self.game.board.get_piece_at(row, col) is None):
-                    valid_moves.append(('place_pawn', row, col))
+        for row, col in iter_squares(self.game.board.pawn_placement_mask(color)):
+            valid_moves.append(('place_pawn', row, col))
 
         # Find all pawns
-        for row in range(8):
-            for col in range(8):
-                piece = self.game.board.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.PAWN and piece.color == color:
-                    valid_moves.append(('upgrade_pawn', row, col, PieceType.FARM))
-                    valid_moves.append(('upgrade_pawn', row, col, PieceType.TURRET))
-                    valid_moves.append(('upgrade_pawn', row, col, PieceType.SHIELD))
+        for row, col in iter_squares(self.game.board.bitboards[color][PieceType.PAWN]):
+            valid_moves.append(('upgrade_pawn', row, col, PieceType.FARM))
+            valid_moves.append(('upgrade_pawn', row, col, PieceType.TURRET))
+            valid_moves.append(('upgrade_pawn', row, col, PieceType.SHIELD))
 
         # Find all potential turret firing moves
-        for row in range(8):
-            for col in range(8):
-                piece = self.game.board.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.TURRET and piece.color == color:
-                    valid_targets = self.game.find_valid_targets_for_turret(row, col)
-                    for target_row, target_col in valid_targets:
-                        valid_moves.append(('fire_turret', row, col, target_row, target_col))
+        for (row, col), valid_targets in self.game.find_all_turret_targets(color).items():
+            for target_row, target_col in valid_targets:
+                valid_moves.append(('fire_turret', row, col, target_row, target_col))
 
         return valid_moves
 
@@ -254,30 +291,24 @@ class QLearningAI:
             return False
 
         color = self.get_current_color()
-        valid_moves = self.find_valid_moves()
-        has_valid_turret_moves = False
+        attack_map = self.game.find_all_turret_targets(color)
 
-        for move in valid_moves:
-            if move[0] == 'fire_turret':
-                has_valid_turret_moves = True
-                turret_row, turret_col, target_row, target_col = move[1], move[2], move[3], move[4]
-                target_piece = self.game.board.get_piece_at(target_row, target_col)
-                if target_piece and target_piece.piece_type == PieceType.KING:
-                    self.game.valid_targets = self.game.find_valid_targets_for_turret(turret_row, turret_col)
-                    self.game.fire_turret(turret_row, turret_col, target_row, target_col)
-                    self.cumulative_reward += 500  
-                    self.log_action(move, 'win', exploration=False)
-                    self.data_collector.log_game_end(self.episode) 
-                    self.game.game_over = True
-                    self.game.winner = self.player_name
-                    return True 
-                else:
-                    self.game.valid_targets = self.game.find_valid_targets_for_turret(turret_row, turret_col) #NEED THIS
-                    self.game.fire_turret(turret_row, turret_col, target_row, target_col)
-                    valid_moves = self.find_valid_moves()
-                    return True
+        for (turret_row, turret_col), valid_targets in attack_map.items():
+            target_row, target_col = valid_targets[0]
+            move = ('fire_turret', turret_row, turret_col, target_row, target_col)
+            target_piece = self.game.board.get_piece_at(target_row, target_col)
+            self.game.valid_targets = valid_targets #NEED THIS
+            self.game.fire_turret(turret_row, turret_col, target_row, target_col)
+            self.data_collector.log_move(self.game, move)
+            if target_piece and target_piece.piece_type == PieceType.KING:
+                self.cumulative_reward += 500  
+                self.log_action(move, 'win', exploration=False)
+                self.data_collector.log_game_end(self.episode) 
+                self.game.game_over = True
+                self.game.winner = self.player_name
+            return True
         
-        return has_valid_turret_moves
+        return False
 
     def decide_move(self):
         if self.game.game_over:
@@ -303,9 +334,10 @@ class QLearningAI:
     def end_game_with_draw(self):
         winner = None
         self.log_action(None, 'draw', exploration=False)
-        self.data_collector.log_game_end(self.episode) # Log the end of the game
         self.game.game_over = True
         self.game.winner = winner
+        self.data_collector.log_move(self.game, ('draw',))
+        self.data_collector.log_game_end(self.episode) # Log the end of the game
 
         # Decay epsilon
         self.epsilon = max(self.min_epsilon, self.epsilon * self.epsilon_decay)
@@ -0,0 +1,661 @@
+import os
+import pickle
+import numpy as np
+
+from ai_game.ai_pieces import PieceType
+from ai_game.state_encoding import is_legacy_q_table, migrate_q_table
+
+'''Array backed Q-table
+
+Every action gets a fixed integer id so a state's Q-values are one row of
+a sparse matrix:
+    0-63     place a pawn on square row * 8 + col
+    64-255   upgrade the pawn on a square, 3 ids per square (farm, turret, shield)
+    256-511  fire the turret on a square, 4 ids per square, one per diagonal
+    512      no action (the agent had no moves left)
+A turret only ever has one target per diagonal, so the direction is enough.'''
+
+PLACE_OFFSET = 0
+UPGRADE_OFFSET = 64
+FIRE_OFFSET = 256
+NO_ACTION = 512
+ACTION_COUNT = 513
+ALL_ACTION_IDS = np.arange(ACTION_COUNT)
+ROW_OVERHEAD = 128  # Rough bytes a state costs on top of its cells: dict entry, int key
+
+UPGRADE_TYPES = (PieceType.FARM, PieceType.TURRET, PieceType.SHIELD)
+UPGRADE_INDEXES = {piece_type: index for index, piece_type in enumerate(UPGRADE_TYPES)}
+
+
+def action_index(action):
+    """Integer id of an action tuple"""
+    if action is None:
+        return NO_ACTION
+    square = action[1] * 8 + action[2]
+    if action[0] == 'place_pawn':
+        return PLACE_OFFSET + square
+    if action[0] == 'upgrade_pawn':
+        return UPGRADE_OFFSET + square * 3 + UPGRADE_INDEXES[action[3]]
+    if action[0] == 'fire_turret':
+        # Same order as ai_board.DIAGONAL_DIRECTIONS: up-left, up-right, down-left, down-right
+        direction = (2 if action[3] > action[1] else 0) + (1 if action[4] > action[2] else 0)
+        return FIRE_OFFSET + square * 4 + direction
+    raise ValueError(f"Action has no Q-table id: {action}")
+
+
+def index_action(index, board):
+    """Action tuple for an id, turret shots need the board to find the target"""
+    if index == NO_ACTION:
+        return None
+    if index < UPGRADE_OFFSET:
+        return ('place_pawn',) + divmod(index - PLACE_OFFSET, 8)
+    if index < FIRE_OFFSET:
+        square, upgrade = divmod(index - UPGRADE_OFFSET, 3)
+        return ('upgrade_pawn',) + divmod(square, 8) + (UPGRADE_TYPES[upgrade],)
+    square, direction = divmod(index - FIRE_OFFSET, 4)
+    target = board.first_piece_on_ray(square, direction)
+    if target is None:
+        return None
+    return ('fire_turret',) + divmod(square, 8) + divmod(target, 8)
+
+
+class QTable:
+    """Maps a state key to its Q-values, one per action id
+
+    Unseen states and actions read as zero, the same default the old dict
+    used. Almost every state only ever gets a few of its actions written,
+    so only those cells are stored: rows numbers the states, every cell
+    keeps its row, action id and value in flat arrays, and the cells of a
+    row are chained together from first_cell through next_cell.
+
+    With max_states set the table is bounded: once full, every new state
+    first evicts a batch of the least visited, longest untouched, lowest
+    valued states, so a long run stays within a fixed amount of memory.
+    """
+    def __init__(self, capacity=1024, dtype=np.float32, max_states=None):
+        self.max_states = max_states
+        if max_states is not None:
+            capacity = min(capacity, max_states)
+        self.rows = {}
+        self.next_row = 0  # Rows below this have been handed out at some point
+        self.free_rows = []  # Rows of evicted states, reused before handing out new ones
+        self.first_cell = np.full(capacity, -1, dtype=np.int32)  # -1 for rows without cells
+        self.visits = np.zeros(capacity, dtype=np.int32)  # Writes per row, only counted when bounded
+        self.last_touch = np.zeros(capacity, dtype=np.int32)  # Episode of the last write, only when bounded
+        self.cell_rows = np.full(capacity, -1, dtype=np.int32)  # -1 for unused cells
+        self.cell_actions = np.zeros(capacity, dtype=np.int16)
+        self.next_cell = np.full(capacity, -1, dtype=np.int32)  # Next cell of the same row
+        self.values = np.zeros(capacity, dtype=dtype)
+        self.cell_count = 0  # Cells below this have been handed out at some point
+        self.free_cells = []
+        self.episode = 0  # Counts self-play games, see start_episode
+        self.evicted = 0
+        self.changes = None  # While tracking, (state, action id) -> value before the first change
+        self.touched = None  # While checkpointing, states written since the last checkpoint
+        self.canonical = True  # Keyed by symmetry class, see ai_game.symmetry.canonicalize_q_table
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, state):
+        return state in self.rows
+
+    def row_for(self, state):
+        """Row number of a state, adding it if it's new"""
+        row = self.rows.get(state)
+        if row is None:
+            if self.max_states is not None and len(self.rows) >= self.max_states:
+                self.evict(max(1, self.max_states // 16))
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = self.next_row
+                self.next_row += 1
+                if row == len(self.visits):
+                    self._grow()
+            self.rows[state] = row
+        return row
+
+    def _grow(self):
+        size = 2 * len(self.visits)
+        if self.max_states is not None:
+            size = min(size, self.max_states)
+        self.first_cell = self._resized(self.first_cell, size, -1)
+        self.visits = self._resized(self.visits, size)
+        self.last_touch = self._resized(self.last_touch, size)
+
+    def _grow_cells(self, size):
+        self.cell_rows = self._resized(self.cell_rows, size, -1)
+        self.cell_actions = self._resized(self.cell_actions, size)
+        self.next_cell = self._resized(self.next_cell, size, -1)
+        self.values = self._resized(self.values, size)
+
+    def _row_cells(self, row):
+        """Cells of a row, newest first"""
+        cells = []
+        cell = int(self.first_cell[row])
+        while cell >= 0:
+            cells.append(cell)
+            cell = int(self.next_cell[cell])
+        return cells
+
+    def _find(self, row, action_id):
+        cell = int(self.first_cell[row])
+        while cell >= 0 and self.cell_actions[cell] != action_id:
+            cell = int(self.next_cell[cell])
+        return cell
+
+    def _cell(self, row, action_id):
+        """Cell of a row's action, adding it if it's new"""
+        cell = self._find(row, action_id)
+        if cell >= 0:
+            return cell
+        if self.free_cells:
+            cell = self.free_cells.pop()
+        else:
+            cell = self.cell_count
+            self.cell_count += 1
+            if cell == len(self.values):
+                self._grow_cells(2 * cell)
+        self.cell_rows[cell] = row
+        self.cell_actions[cell] = action_id
+        self.values[cell] = 0
+        self.next_cell[cell] = self.first_cell[row]
+        self.first_cell[row] = cell
+        return cell
+
+    def _link_cells(self, rows, action_ids, values):
+        """Replaces every cell with these, rows and action ids as arrays"""
+        order = np.lexsort((action_ids, rows))
+        rows = np.asarray(rows, dtype=np.int32)[order]
+        count = len(rows)
+        self._grow_cells(max(1024, count))
+        self.cell_rows[:] = -1
+        self.cell_rows[:count] = rows
+        self.cell_actions[:count] = np.asarray(action_ids)[order]
+        self.values[:] = 0
+        self.values[:count] = np.asarray(values)[order]
+        self.next_cell[:] = -1
+        self.first_cell[:] = -1
+        if count:
+            same_row = rows[1:] == rows[:-1]
+            self.next_cell[:count - 1][same_row] = np.flatnonzero(same_row) + 1
+            starts = np.flatnonzero(np.concatenate(([True], ~same_row)))
+            self.first_cell[rows[starts]] = starts
+        self.cell_count = count
+        self.free_cells = []
+
+    def _live_cells(self):
+        return np.flatnonzero(self.cell_rows[:self.cell_count] >= 0)
+
+    def start_episode(self):
+        """Called by the trainer before every game, rows written from here on count as recent"""
+        self.episode += 1
+
+    def evict(self, count):
+        """Drops the count states least worth keeping
+
+        States written this episode are only dropped if nothing else is
+        left. Of the rest the least visited go first, ties broken by the
+        oldest last write and then the smallest Q-values.
+        """
+        states = list(self.rows)
+        row_ids = np.fromiter(self.rows.values(), dtype=np.int64, count=len(states))
+        current = self.last_touch[row_ids] == self.episode
+        cells = self._live_cells()
+        strength = np.zeros(len(self.visits))
+        np.maximum.at(strength, self.cell_rows[cells], np.abs(self.values[cells].astype(np.float64)))
+        order = np.lexsort((strength[row_ids], self.last_touch[row_ids], self.visits[row_ids], current))
+        dropped = np.zeros(len(self.visits), dtype=bool)
+        for index in order[:count]:
+            row = int(row_ids[index])
+            del self.rows[states[index]]
+            self.visits[row] = 0
+            self.last_touch[row] = 0
+            self.first_cell[row] = -1
+            self.free_rows.append(row)
+            dropped[row] = True
+        freed = cells[dropped[self.cell_rows[cells]]]
+        self.cell_rows[freed] = -1
+        self.free_cells.extend(freed.tolist())
+        self.evicted += min(count, len(states))
+
+    def memory_bytes(self):
+        return (self.first_cell.nbytes + self.visits.nbytes + self.last_touch.nbytes + self.cell_rows.nbytes
+                + self.cell_actions.nbytes + self.next_cell.nbytes + self.values.nbytes + len(self.rows) * ROW_OVERHEAD)
+
+    def set_memory_limit(self, limit_bytes):
+        """Bounds the table to about limit_bytes, evicting and shrinking right away if it's already over
+
+        What a state costs depends on how many of its actions get written,
+        so that's taken from the table as it is now.
+        """
+        cells_per_state = max(1.0, len(self._live_cells()) / max(len(self.rows), 1))
+        cell_bytes = self.cell_rows.itemsize + self.cell_actions.itemsize + self.next_cell.itemsize + self.values.itemsize
+        state_bytes = ROW_OVERHEAD + 12 + cells_per_state * cell_bytes
+        self.max_states = max(1, int(int(limit_bytes) // state_bytes))
+        if len(self.rows) > self.max_states:
+            self.evict(len(self.rows) - self.max_states)
+        if len(self.visits) > self.max_states:
+            rows, row_ids = self._renumbered()
+            renumber = np.full(len(self.visits), -1, dtype=np.int32)
+            renumber[row_ids] = np.arange(len(row_ids))
+            cells = self._live_cells()
+            cell_rows, action_ids, values = renumber[self.cell_rows[cells]], self.cell_actions[cells], self.values[cells]
+            self.visits = self._resized(self.visits[row_ids], self.max_states)
+            self.last_touch = self._resized(self.last_touch[row_ids], self.max_states)
+            self.first_cell = np.full(self.max_states, -1, dtype=np.int32)
+            self._link_cells(cell_rows, action_ids, values)
+            self.rows = rows
+            self.next_row = len(rows)
+            self.free_rows = []
+
+    @staticmethod
+    def _resized(array, size, fill=0):
+        resized = np.full((size,) + array.shape[1:], fill, dtype=array.dtype)
+        resized[:min(len(array), size)] = array[:size]
+        return resized
+
+    def _renumbered(self):
+        """The rows dict numbered 0 to n - 1 in order, plus the old row of each"""
+        row_ids = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        return {state: row for row, state in enumerate(self.rows)}, row_ids
+
+    def stats(self):
+        return {
+            'states': len(self.rows),
+            'cells': self.cell_count - len(self.free_cells),
+            'max_states': self.max_states,
+            'megabytes': round(self.memory_bytes() / 2 ** 20, 1),
+            'evicted': self.evicted,
+        }
+
+    def get(self, state, action_id, default=0.0):
+        row = self.rows.get(state)
+        if row is None:
+            return default
+        cell = self._find(row, action_id)
+        return float(self.values[cell]) if cell >= 0 else 0.0
+
+    def set(self, state, action_id, value):
+        row = self.row_for(state)
+        cell = self._cell(row, action_id)
+        if self.changes is not None and (state, action_id) not in self.changes:
+            self.changes[(state, action_id)] = float(self.values[cell])
+        if self.touched is not None:
+            self.touched.add(state)
+        if self.max_states is not None:
+            self.visits[row] += 1
+            self.last_touch[row] = self.episode
+        self.values[cell] = value
+
+    def track_touched(self):
+        """Starts remembering which states get written, for checkpointing"""
+        self.touched = set()
+
+    def take_touched(self):
+        """The full rows of Q-values written since the last call, then starts over"""
+        rows = {state: self._full_row(self.rows[state]) for state in self.touched if state in self.rows}
+        self.touched = set()
+        return rows
+
+    def track_changes(self):
+        """Starts remembering which entries get written from now on"""
+        self.changes = {}
+
+    def take_changes(self):
+        """How far each entry moved since tracking started, then starts over"""
+        deltas = {}
+        for (state, action_id), old_value in self.changes.items():
+            if state not in self.rows:
+                continue  # Evicted, nothing worth sending back
+            deltas[(state, action_id)] = self.get(state, action_id) - old_value
+        self.changes = {}
+        return deltas
+
+    def apply_changes(self, change_sets):
+        """Adds deltas from several copies of this table, averaging entries more than one copy changed"""
+        totals = {}
+        for deltas in change_sets:
+            for key, delta in deltas.items():
+                total, count = totals.get(key, (0.0, 0))
+                totals[key] = (total + delta, count + 1)
+        for (state, action_id), (total, count) in totals.items():
+            self.set(state, action_id, self.get(state, action_id) + total / count)
+
+    def snapshot(self):
+        """Copy of the table as it is now, for writing out on another thread while this one keeps learning"""
+        copy = object.__new__(type(self))
+        for name, value in self.__dict__.items():
+            if name not in ('changes', 'touched') and isinstance(value, (np.ndarray, dict, list)):
+                value = value.copy()
+            setattr(copy, name, value)
+        copy.changes = None
+        copy.touched = None
+        return copy
+
+    def _full_row(self, row):
+        """All ACTION_COUNT stored values of a row, zeros where there's no cell"""
+        values = np.zeros(ACTION_COUNT, dtype=self.values.dtype)
+        cells = self._row_cells(row)
+        if cells:
+            values[self.cell_actions[cells]] = self.values[cells]
+        return values
+
+    def values_for(self, state, action_ids):
+        """Q-values of some actions in a state, as an array"""
+        row = self.rows.get(state)
+        if row is None or self.first_cell[row] < 0:
+            return np.zeros(len(action_ids), dtype=self.values.dtype)
+        return self._full_row(row)[action_ids]
+
+    def max_value(self, state, action_ids):
+        if len(action_ids) == 0:
+            return 0.0
+        return float(self.values_for(state, action_ids).max())
+
+    def _cells_by_row(self):
+        """(row, action id, cell) of every stored cell, sorted by row and action"""
+        cells = self._live_cells()
+        order = np.lexsort((self.cell_actions[cells], self.cell_rows[cells]))
+        cells = cells[order]
+        return self.cell_rows[cells], self.cell_actions[cells], cells
+
+    def items(self):
+        """((state, action id), value) for every stored non-zero entry"""
+        states = {row: state for state, row in self.rows.items()}
+        cell_rows, action_ids, cells = self._cells_by_row()
+        for row, action_id, value in zip(cell_rows.tolist(), action_ids.tolist(), self.values[cells].tolist()):
+            if value:
+                yield (states[row], action_id), value
+
+    def iter_rows(self):
+        """(state, full row of Q-values) for every stored state"""
+        for state, row in self.rows.items():
+            yield state, self._full_row(row)
+
+    def set_row(self, state, row):
+        """Overwrites all of a state's Q-values at once"""
+        index = self.row_for(state)
+        if self.touched is not None:
+            self.touched.add(state)
+        if self.max_states is not None:
+            self.visits[index] += 1
+            self.last_touch[index] = self.episode
+        row = np.asarray(row)
+        cells = self._row_cells(index)
+        if cells:
+            self.values[cells] = row[self.cell_actions[cells]]
+        stored = set(self.cell_actions[cells].tolist())
+        for action_id in np.flatnonzero(row).tolist():
+            if action_id not in stored:
+                cell = self._cell(index, action_id)  # Can grow the arrays, so before self.values is looked up
+                self.values[cell] = row[action_id]
+
+    @classmethod
+    def from_dict(cls, q_table):
+        """Builds a table from a dict keyed by (state, action tuple)"""
+        table = cls(capacity=max(1024, len(q_table)))
+        for (state, action), q_value in q_table.items():
+            table.set(state, action_index(action), q_value)
+        return table
+
+    def __getstate__(self):
+        # Only the non-zero cells get pickled. Evicted rows have no cells, so the rest get renumbered from 0.
+        rows, old_rows = self._renumbered()
+        renumber = np.zeros(max(self.next_row, 1), dtype=np.int64)
+        renumber[old_rows] = np.arange(len(old_rows))
+        cell_rows, action_ids, cells = self._cells_by_row()
+        values = self.values[cells]
+        nonzero = values != 0
+        new_row_ids = renumber[cell_rows[nonzero]]
+        order = np.argsort(new_row_ids, kind='stable')
+        return {
+            'rows': rows,
+            'dtype': self.values.dtype.str,
+            'row_counts': np.bincount(new_row_ids, minlength=len(rows)).astype(np.int16),
+            'action_ids': action_ids[nonzero][order].astype(np.int16),
+            'cells': values[nonzero][order],
+            'max_states': self.max_states,
+            'visits': self.visits[old_rows],
+            'last_touch': self.last_touch[old_rows],
+            'episode': self.episode,
+            'evicted': self.evicted,
+            'canonical': self.canonical,
+        }
+
+    def __setstate__(self, state):
+        rows = state['rows']
+        max_states = state.get('max_states')
+        capacity = max(1024, len(rows))
+        if max_states is not None:
+            capacity = max(min(capacity, max_states), len(rows))
+        if 'row_counts' in state:
+            row_ids = np.repeat(np.arange(len(rows)), state['row_counts'])
+        else:
+            row_ids = state['row_ids']  # Pickled before rows were stored as counts
+        QTable.__init__(self, capacity, np.dtype(state['dtype']))
+        self.max_states = max_states
+        self.rows = rows
+        self.next_row = len(rows)
+        self._link_cells(row_ids, state['action_ids'], state['cells'])
+        if 'visits' in state:
+            self.visits[:len(rows)] = state['visits']
+            self.last_touch[:len(rows)] = state['last_touch']
+        self.episode = state.get('episode', 0)
+        self.evicted = state.get('evicted', 0)
+        self.canonical = state.get('canonical', False)  # Older tables may hold raw states
+
+
+class QuantizedQTable(QTable):
+    """QTable that stores every Q-value as an int16 count of scale
+
+    Half the memory and pickle size of float32 storage. Updates aim at
+    cumulative_reward plus the discounted next value, and by the king shot
+    cumulative_reward holds its 1000 reward, the 500 win bonus and every
+    board reward of the game before it. Bootstrapping with gamma=0.9 takes
+    the states leading up to it towards ten times that, so 15000 and more.
+    The default scale of 1 covers -32767 to 32767 in whole steps, the
+    rewards are whole numbers anyway. Values outside the range are clipped
+    and counted in stats(), updates smaller than half a step round away.
+    """
+    def __init__(self, capacity=1024, max_states=None, scale=1.0):
+        super().__init__(capacity, np.int16, max_states)
+        self.scale = scale
+        self.clipped = 0  # Values written since the table was created or loaded that didn't fit
+
+    def quantize(self, values):
+        counts = np.rint(np.asarray(values) / self.scale)
+        clipped = np.count_nonzero(np.abs(counts) > 32767)
+        if clipped:
+            self.clipped += int(clipped)
+        return np.clip(counts, -32767, 32767).astype(np.int16)
+
+    def stats(self):
+        stats = super().stats()
+        stats['clipped'] = self.clipped
+        return stats
+
+    def get(self, state, action_id, default=0.0):
+        value = super().get(state, action_id, None)
+        return default if value is None else value * self.scale
+
+    def set(self, state, action_id, value):
+        super().set(state, action_id, self.quantize(value))
+
+    def set_row(self, state, row):
+        super().set_row(state, self.quantize(row))
+
+    def values_for(self, state, action_ids):
+        return super().values_for(state, action_ids) * np.float32(self.scale)
+
+    def take_touched(self):
+        return {state: row * np.float32(self.scale) for state, row in super().take_touched().items()}
+
+    def take_changes(self):
+        # The base class recorded the stored integers
+        self.changes = {key: old_value * self.scale for key, old_value in self.changes.items()}
+        return super().take_changes()
+
+    def items(self):
+        for key, value in super().items():
+            yield key, value * self.scale
+
+    def iter_rows(self):
+        for state, row in super().iter_rows():
+            yield state, row * np.float32(self.scale)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['scale'] = self.scale
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.scale = state['scale']
+        self.clipped = 0
+
+
+STORAGE_TYPES = ('float32', 'float16', 'int16')
+
+
+def new_q_table(storage='float32', capacity=1024, max_states=None):
+    """Empty table keeping its Q-values as one of STORAGE_TYPES"""
+    if storage == 'int16':
+        return QuantizedQTable(capacity, max_states)
+    if storage in STORAGE_TYPES:
+        return QTable(capacity, np.dtype(storage), max_states)
+    raise ValueError(f"Unknown Q-value storage {storage!r}, expected one of {STORAGE_TYPES}")
+
+
+def table_storage(q_table):
+    if isinstance(q_table, QuantizedQTable):
+        return 'int16'
+    return q_table.values.dtype.name if isinstance(q_table, QTable) else 'float32'
+
+
+def convert_storage(q_table, storage):
+    """Copy of a table with its Q-values kept as another storage type"""
+    table = new_q_table(storage, max(1024, len(q_table)), getattr(q_table, 'max_states', None))
+    for state, row in q_table.iter_rows():
+        table.set_row(state, row)
+    table.canonical = getattr(q_table, 'canonical', True)
+    return table
+
+
+def load_q_table(file_path='qtable/q_table.pkl', replay_logs=True, storage=None, canonical=True, memory_limit=None):
+    """Loads a QTable, converting older dict based tables on the way
+
+    .qdb files are opened as a MappedQTable instead of being read in. Rows
+    checkpointed to the delta logs next to the file (see ai_game.q_checkpoint)
+    are replayed on top unless replay_logs is False. With canonical set,
+    tables keyed by raw states (migrated ones, older pickles, ones trained
+    with use_symmetry=False) are re-keyed by symmetry class so QLearningAI
+    can find their entries. With storage set the table is converted to that
+    storage type if it isn't already. With memory_limit (in bytes) the
+    table is bounded as soon as the file is read, so the logs replay into
+    a table that evicts as it goes instead of growing to its full size.
+    """
+    q_table = _read_q_table(file_path)
+    if memory_limit is not None:
+        q_table.set_memory_limit(memory_limit)
+    if replay_logs:
+        for log_path in delta_log_paths(file_path):
+            replay_delta_log(q_table, log_path)
+    if canonical and not getattr(q_table, 'canonical', True):
+        from ai_game.symmetry import canonicalize_q_table
+        q_table = canonicalize_q_table(q_table)
+    if storage is not None and table_storage(q_table) != storage:
+        q_table = convert_storage(q_table, storage)
+        if memory_limit is not None:
+            q_table.set_memory_limit(memory_limit)  # A state costs less with 16 bit values
+    return q_table
+
+
+def _read_q_table(file_path):
+    if file_path.endswith('.qdb'):
+        from ai_game.mapped_q_table import MappedQTable
+        return MappedQTable(file_path)
+    if not os.path.exists(file_path):
+        return QTable()
+    with open(file_path, 'rb') as file:
+        q_table = pickle.load(file)
+    if isinstance(q_table, dict):
+        if is_legacy_q_table(q_table):
+            q_table = migrate_q_table(q_table)
+        q_table = QTable.from_dict(q_table)
+        q_table.canonical = False
+    return q_table
+
+
+def write_q_table(q_table, file_path):
+    """Writes the whole table through a temporary file, so a crash never leaves half a table behind"""
+    if file_path.endswith('.qdb'):
+        from ai_game.mapped_q_table import MappedQTable, write_mapped_q_table
+        if isinstance(q_table, MappedQTable):
+            q_table.save(file_path)
+        else:
+            write_mapped_q_table(q_table, file_path)
+        return
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path + '.tmp', 'wb') as file:
+        pickle.dump(q_table, file)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def save_q_table(q_table, file_path='qtable/q_table.pkl'):
+    """Writes the whole table, which makes any delta logs next to it redundant"""
+    write_q_table(q_table, file_path)
+    for log_path in delta_log_paths(file_path):
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+
+def delta_log_paths(file_path):
+    """The sealed log being compacted, then the live one, in the order they get replayed"""
+    return [file_path + '.log.old', file_path + '.log']
+
+
+def last_modified(file_path):
+    """Latest change to a table file or its delta logs, 0 if none of them exist"""
+    return max((os.path.getmtime(path) for path in [file_path] + delta_log_paths(file_path) if os.path.exists(path)), default=0)
+
+
+def append_delta_log(rows, log_path):
+    """Appends {state: row of Q-values} to a delta log as one record and syncs it to disk"""
+    record = {}
+    for state, row in rows.items():
+        action_ids = np.flatnonzero(row)
+        record[state] = (action_ids.astype(np.int16), row[action_ids])
+    with open(log_path, 'ab') as file:
+        pickle.dump(record, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def replay_delta_log(q_table, log_path):
+    """Overwrites rows with the ones in a delta log, oldest record first
+
+    A record cut short by a crash ends the replay, everything before it is kept.
+    """
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, 'rb') as file:
+        while True:
+            try:
+                record = pickle.load(file)
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                break
+            for state, (action_ids, values) in record.items():
+                row = np.zeros(ACTION_COUNT, dtype=np.float32)
+                row[action_ids] = values
+                current = q_table.values_for(state, ALL_ACTION_IDS)
+                for action_id in np.flatnonzero(current != row):
+                    q_table.set(state, int(action_id), float(row[action_id]))
+
+
+def convert_q_table(source='qtable/q_table.pkl', target='qtable/q_table.qdb'):
+    """Rewrites a Q-table in another format, picked by the file extensions"""
+    save_q_table(load_q_table(source), target)
@@ -0,0 +1,62 @@
+import numpy as np
+
+'''Experience replay for QLearningAI
+
+Transitions go into preallocated ring buffers, so memory stays the same
+however long training runs, and once the oldest entries get overwritten
+the agent learns from a random mix of recent moves instead of each move
+in the order it was played.
+
+This is for learning, not for speed. Every sampled transition is still
+one Q-table get, max and set in Python, so a move costs about what an
+online update does when batch_size equals update_every (the defaults),
+and batch_size / update_every times that otherwise.'''
+
+
+class ReplayBuffer:
+    """Fixed size ring of (state, action id, reward, next state, terminal) transitions
+
+    States are Q-table state keys, already mapped to their symmetry class.
+    They're too wide for an integer dtype so those two buffers hold
+    references to the ints, and Q-table row numbers can't stand in for
+    them because evicted rows get reused. Every update_every added
+    transitions ready() turns true and sample() hands out a minibatch of
+    batch_size of them.
+    """
+    def __init__(self, capacity=65536, batch_size=16, update_every=16, seed=None):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.update_every = update_every
+        self.states = np.empty(capacity, dtype=object)
+        self.action_ids = np.zeros(capacity, dtype=np.int16)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.empty(capacity, dtype=object)
+        self.terminal = np.zeros(capacity, dtype=bool)  # The next state had no valid moves
+        self.position = 0  # Where the next transition goes
+        self.size = 0
+        self.added = 0  # Since the last sample
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action_id, reward, next_state, terminal):
+        position = self.position
+        self.states[position] = state
+        self.action_ids[position] = action_id
+        self.rewards[position] = reward
+        self.next_states[position] = next_state
+        self.terminal[position] = terminal
+        self.position = (position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+
+    def ready(self):
+        return self.added >= self.update_every
+
+    def sample(self):
+        """(states, action ids, rewards, next states, terminal) arrays of a random minibatch"""
+        self.added = 0
+        indexes = self.rng.integers(0, self.size, min(self.batch_size, self.size))
+        return (self.states[indexes], self.action_ids[indexes], self.rewards[indexes],
+                self.next_states[indexes], self.terminal[indexes])
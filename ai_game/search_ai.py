@@ -0,0 +1,194 @@
+import time
+
+from ai_game import log_levels
+from ai_game.ai_pieces import PieceType
+from ai_game.board_evaluation import PIECE_VALUES, evaluate_board
+
+'''Alpha-beta search opponent
+
+Searches the game tree with Game.push/pop one action at a time, deeper and
+deeper until the time budget for the action runs out, and plays the best
+action of the deepest search it finished. A player keeps moving until it
+ends its turn, so the side to move only flips on end_turn (and in the
+opening, after each side's farm). Values are always from the point of view
+of the side to move.'''
+
+WIN = 100000  # Shooting the king, less the plies it takes so faster wins score higher
+EXACT = 0
+LOWER = 1  # The value is at least this, the search failed high
+UPPER = 2  # The value is at most this, it failed low
+
+# Move ordering after the transposition table's move, lower goes first
+KIND_ORDER = {'fire_turret': 0, 'upgrade_pawn': 2, 'place_pawn': 3, 'buy_action': 4, 'place_king': 5, 'place_farm': 5, 'end_turn': 6}
+
+
+class OutOfTime(Exception):
+    pass
+
+
+def side(turn):
+    return "white" if turn.startswith("white") else "black"
+
+
+class SearchAI:
+    """Iterative deepening alpha-beta with a transposition table keyed by Game.zobrist_hash
+
+    time_limit is the budget per action in seconds. The table keeps
+    (depth, value, bound, best move) per position and is cleared once it
+    holds more than table_size of them.
+    """
+    def __init__(self, game, player_name, time_limit=0.2, max_depth=32, table_size=1 << 20):
+        self.game = game
+        self.player_name = player_name
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.table = {}
+        self.deadline = 0.0
+        self.nodes = 0
+        self.depth_reached = 0
+
+    def make_move(self):
+        """Plays the AI's whole turn, searching each action on its own"""
+        color = side(self.game.turn)
+        while not self.game.game_over and side(self.game.turn) == color:
+            move = self.best_move()
+            if move is None:
+                self.game.advance_turn()  # No farm fits next to the king, same as the other AIs passing
+                break
+            self.game.push(move)
+        self.game.undo_stack.clear()  # The moves are real, nothing should take them back
+
+    def best_move(self):
+        """The best action for the side to move that the time budget allows, or None if there is none"""
+        moves = self.game.legal_moves()
+        if len(moves) <= 1:
+            return moves[0] if moves else None
+        self.deadline = time.perf_counter() + self.time_limit
+        self.nodes = 0
+        if len(self.table) > self.table_size:
+            self.table.clear()
+        saved_level = log_levels.level
+        log_levels.level = log_levels.SUMMARY  # Keeps the searched shots from printing
+        best = None
+        try:
+            for depth in range(1, self.max_depth + 1):
+                try:
+                    value, move = self._root(moves, depth, best)
+                except OutOfTime:
+                    break
+                best = move
+                self.depth_reached = depth
+                if abs(value) >= WIN - self.max_depth:
+                    break  # A forced win or loss, looking deeper won't change it
+        finally:
+            log_levels.level = saved_level
+        return best or self._ordered(moves, None)[0]
+
+    def _root(self, moves, depth, previous_best):
+        alpha = -WIN - 1
+        best = None
+        for move in self._ordered(moves, previous_best):
+            value = self._child_value(move, depth, alpha, WIN + 1, 0)
+            if value > alpha:
+                alpha, best = value, move
+        return alpha, best
+
+    def _child_value(self, move, depth, alpha, beta, ply):
+        """Value of a move for the side playing it"""
+        if self._is_king_shot(move):
+            return WIN - ply
+        game = self.game
+        mover = side(game.turn)
+        game.push(move)
+        try:
+            if side(game.turn) == mover:
+                return self._search(depth - 1, alpha, beta, ply + 1)
+            return -self._search(depth - 1, -beta, -alpha, ply + 1)
+        finally:
+            game.pop()
+
+    def _search(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 255 == 0 and time.perf_counter() > self.deadline:
+            raise OutOfTime()
+        game = self.game
+        if depth <= 0:
+            return self._evaluate()
+
+        key = game.zobrist_hash()
+        entry = self.table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, value, bound, table_move = entry
+            value = self._from_table(value, ply)
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return value
+                if bound == LOWER and value >= beta:
+                    return value
+                if bound == UPPER and value <= alpha:
+                    return value
+
+        moves = game.legal_moves()
+        if not moves:
+            return self._evaluate()
+        original_alpha = alpha
+        best_value = -WIN - 1
+        best_move = None
+        for move in self._ordered(moves, table_move):
+            value = self._child_value(move, depth, alpha, beta, ply)
+            if value > best_value:
+                best_value, best_move = value, move
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+        bound = LOWER if best_value >= beta else UPPER if best_value <= original_alpha else EXACT
+        self.table[key] = (depth, self._to_table(best_value, ply), bound, best_move)
+        return best_value
+
+    def _to_table(self, value, ply):
+        """Win scores count plies from the root, the table keeps them counted from the position itself
+
+        The same position can come up at another ply, or in a later search
+        from a new root, and the win is as far away from it either way.
+        """
+        if value >= WIN - self.max_depth:
+            return value + ply
+        if value <= self.max_depth - WIN:
+            return value - ply
+        return value
+
+    def _from_table(self, value, ply):
+        if value >= WIN - self.max_depth:
+            return value - ply
+        if value <= self.max_depth - WIN:
+            return value + ply
+        return value
+
+    def _evaluate(self):
+        score = evaluate_board(self.game)
+        return score if side(self.game.turn) == "white" else -score
+
+    def _is_king_shot(self, move):
+        if move[0] != 'fire_turret':
+            return False
+        target = self.game.board.get_piece_at(move[3], move[4])
+        return target is not None and target.piece_type == PieceType.KING
+
+    def _ordered(self, moves, table_move):
+        """Table move first, then king shots and other captures by the value of what they hit"""
+        board = self.game.board
+
+        def order(move):
+            if move == table_move:
+                return (-1, 0)
+            kind = move[0]
+            if kind == 'fire_turret':
+                target = board.get_piece_at(move[3], move[4])
+                return (KIND_ORDER[kind], -PIECE_VALUES[target.piece_type] if target else 0)
+            if kind == 'upgrade_pawn' and move[3] == PieceType.TURRET:
+                return (1, 0)
+            return (KIND_ORDER[kind], 0)
+        return sorted(moves, key=order)
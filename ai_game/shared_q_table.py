@@ -0,0 +1,210 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from ai_game.q_table import ACTION_COUNT, QTable
+from ai_game.state_encoding import KEY_BYTES, state_fingerprint
+
+'''Q-table that lives in shared memory so self-play processes can all use it
+
+Layout of the block, state slots found by linear probing on a 64-bit fingerprint:
+    header        int64[3]                 (states stored, capacity, cells stored)
+    fingerprints  uint64[capacity]         0 marks an empty slot
+    keys          uint8[capacity, 40]      full packed state, compared on a fingerprint match
+    first_cell    int32[capacity]          first cell of each state, -1 for none
+    next_cell     int32[cells]             next cell of the same state
+    cell_rows     int32[cells]             state slot of each cell
+    cell_values   float32[cells]           Q-value of each cell
+    cell_actions  int16[cells]             action id of each cell
+Like QTable only the (state, action) cells that get written are stored,
+there's room for capacity * cells_per_state of them. Claiming a slot or a
+cell takes the lock. Reads and Q-value writes don't, two processes
+updating the same entry at once just lose one of the updates, which
+Q-learning shrugs off.'''
+
+class SharedQTable:
+    """Fixed capacity Q-table with the same interface as QTable"""
+    def __init__(self, capacity=2 ** 17, name=None, lock=None, cells_per_state=4):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.capacity = capacity
+        self.cells_per_state = cells_per_state
+        self.cell_capacity = capacity * cells_per_state
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        size = 24 + capacity * (8 + KEY_BYTES + 4) + self.cell_capacity * (4 + 4 + 4 + 2)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self._map_arrays()
+        if self.owner:
+            self.header[:] = (0, capacity, 0)
+            self.first_cell[:] = -1
+
+    def _map_arrays(self):
+        buffer = self.shm.buf
+        capacity = self.capacity
+        offset = 0
+        self.header = np.ndarray((3,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset += 24
+        self.fingerprints = np.ndarray((capacity,), dtype=np.uint64, buffer=buffer, offset=offset)
+        offset += 8 * capacity
+        self.keys = np.ndarray((capacity, KEY_BYTES), dtype=np.uint8, buffer=buffer, offset=offset)
+        offset += KEY_BYTES * capacity
+        self.first_cell = np.ndarray((capacity,), dtype=np.int32, buffer=buffer, offset=offset)
+        offset += 4 * capacity
+        cells = self.cell_capacity
+        self.next_cell = np.ndarray((cells,), dtype=np.int32, buffer=buffer, offset=offset)
+        offset += 4 * cells
+        self.cell_rows = np.ndarray((cells,), dtype=np.int32, buffer=buffer, offset=offset)
+        offset += 4 * cells
+        self.cell_values = np.ndarray((cells,), dtype=np.float32, buffer=buffer, offset=offset)
+        offset += 4 * cells
+        self.cell_actions = np.ndarray((cells,), dtype=np.int16, buffer=buffer, offset=offset)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return int(self.header[0])
+
+    def __contains__(self, state):
+        return self._slot(state) is not None
+
+    def start_episode(self):
+        """Nothing to do, the capacity is fixed when the block is made"""
+
+    def stats(self):
+        return {
+            'states': len(self),
+            'cells': int(self.header[2]),
+            'megabytes': round(self.shm.size / 2 ** 20, 1),
+        }
+
+    def __getstate__(self):
+        # Only works while starting a child process, because of the lock
+        return {'capacity': self.capacity, 'name': self.shm.name, 'lock': self.lock, 'cells_per_state': self.cells_per_state}
+
+    def __setstate__(self, state):
+        self.__init__(state['capacity'], name=state['name'], lock=state['lock'], cells_per_state=state['cells_per_state'])
+
+    def _slot(self, state):
+        return self._find(state_fingerprint(state), state.to_bytes(KEY_BYTES, 'little'))
+
+    def _find(self, fingerprint, key):
+        """Slot of the state with this fingerprint and packed key, two states can share a fingerprint"""
+        slot = fingerprint & (self.capacity - 1)
+        for probe in range(self.capacity):
+            stored = int(self.fingerprints[slot])
+            if stored == fingerprint and self.keys[slot].tobytes() == key:
+                return slot
+            if stored == 0:
+                return None
+            slot = (slot + 1) & (self.capacity - 1)
+        return None
+
+    def _find_cell(self, slot, action_id):
+        cell = int(self.first_cell[slot])
+        while cell >= 0 and self.cell_actions[cell] != action_id:
+            cell = int(self.next_cell[cell])
+        return cell
+
+    def row_for(self, state):
+        """Slot of a state, claiming an empty one if it's new"""
+        fingerprint = state_fingerprint(state)
+        key = state.to_bytes(KEY_BYTES, 'little')
+        slot = self._find(fingerprint, key)
+        if slot is not None:
+            return slot
+        with self.lock:
+            slot = fingerprint & (self.capacity - 1)
+            for probe in range(self.capacity):
+                stored = int(self.fingerprints[slot])
+                if stored == fingerprint and self.keys[slot].tobytes() == key:
+                    return slot  # Another process got here first
+                if stored == 0:
+                    self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                    self.fingerprints[slot] = fingerprint  # Written last so readers never see a half made slot
+                    self.header[0] += 1
+                    return slot
+                slot = (slot + 1) & (self.capacity - 1)
+        raise RuntimeError(f"Shared Q-table is full ({self.capacity} states)")
+
+    def _cell(self, slot, action_id):
+        """Cell of a state's action, claiming one if it's new"""
+        cell = self._find_cell(slot, action_id)
+        if cell >= 0:
+            return cell
+        with self.lock:
+            cell = self._find_cell(slot, action_id)
+            if cell >= 0:
+                return cell  # Another process got here first
+            cell = int(self.header[2])
+            if cell == self.cell_capacity:
+                raise RuntimeError(f"Shared Q-table is full ({cell} cells)")
+            self.cell_rows[cell] = slot
+            self.cell_actions[cell] = action_id
+            self.cell_values[cell] = 0
+            self.next_cell[cell] = self.first_cell[slot]
+            self.first_cell[slot] = cell  # Written last, same as the fingerprints
+            self.header[2] += 1
+            return cell
+
+    def get(self, state, action_id, default=0.0):
+        slot = self._slot(state)
+        if slot is None:
+            return default
+        cell = self._find_cell(slot, action_id)
+        return float(self.cell_values[cell]) if cell >= 0 else 0.0
+
+    def set(self, state, action_id, value):
+        self.cell_values[self._cell(self.row_for(state), action_id)] = value
+
+    def values_for(self, state, action_ids):
+        slot = self._slot(state)
+        values = np.zeros(ACTION_COUNT, dtype=np.float32)
+        if slot is not None:
+            cell = int(self.first_cell[slot])
+            while cell >= 0:
+                values[self.cell_actions[cell]] = self.cell_values[cell]
+                cell = int(self.next_cell[cell])
+        return values[action_ids]
+
+    def max_value(self, state, action_ids):
+        if len(action_ids) == 0:
+            return 0.0
+        return float(self.values_for(state, action_ids).max())
+
+    @classmethod
+    def from_q_table(cls, q_table, capacity=2 ** 17, cells_per_state=4):
+        shared = cls(capacity, cells_per_state=cells_per_state)
+        try:
+            for (state, action_id), value in q_table.items():
+                shared.set(state, action_id, value)
+        except RuntimeError:
+            shared.close()
+            raise
+        return shared
+
+    def to_q_table(self):
+        """Copies everything into an ordinary QTable, e.g. for saving"""
+        q_table = QTable(capacity=max(1024, len(self)))
+        cells = int(self.header[2])
+        states = {}
+        for row, action_id, value in zip(self.cell_rows[:cells].tolist(), self.cell_actions[:cells].tolist(),
+                                         self.cell_values[:cells].tolist()):
+            if row not in states:
+                states[row] = int.from_bytes(self.keys[row].tobytes(), 'little')
+            q_table.set(states[row], action_id, value)
+        return q_table
+
+    def close(self):
+        """Detaches from the block, the process that created it also frees it"""
+        self.header = self.fingerprints = self.keys = None
+        self.first_cell = self.next_cell = self.cell_rows = self.cell_values = self.cell_actions = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
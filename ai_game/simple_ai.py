@@ -6,13 +6,40 @@ this is an ai that just does random moves'''
 import random
 from ai_game.ai_pieces import PieceType, Piece
 from ai_game.ai_logic import Game
+from ai_game.ai_board import iter_squares
 from ai_game.data_collection import DataCollector
+from ai_game.log_levels import move_message
+
+
+def random_move(game):
+    """What SimpleAI would do next, as a move for Game.push, without any of its logging
+
+    Buys every action it can afford, shoots the enemy king when a turret
+    has it in sight and otherwise picks any action at random, ending the
+    turn once it has none left. Used for MCTS rollouts.
+    """
+    moves = game.legal_moves()
+    if not moves:
+        return None
+    if game.initial_phase:
+        return random.choice(moves)
+    if ('buy_action',) in moves[-2:]:  # legal_moves lists it just before end_turn
+        return ('buy_action',)
+    color = "white" if game.turn.startswith("white") else "black"
+    enemy_king = game.board.king_positions["black" if color == "white" else "white"]
+    actions = []
+    for move in moves:
+        if move[0] == 'fire_turret' and (move[3], move[4]) == enemy_king:
+            return move
+        if move[0] != 'end_turn':
+            actions.append(move)
+    return random.choice(actions) if actions else ('end_turn',)
 
 class SimpleAI(Game):
     def __init__(self, game, player_name):
         super().__init__()
         self.game = game
-        self.data_collector = DataCollector()
+        self.data_collector = DataCollector.shared()
         self.player_name = player_name
 
     def make_move(self):
@@ -102,30 +129,19 @@ class SimpleAI(Game):
         valid_moves = []
 
         # Find all valid pawn placement positions
-        for row in range(8):
-            for col in range(8):
-                if (self.game.board.is_adjacent_to_piece(row, col, color) and 
-                    self.game.board.is_valid_position(row, col) and 
-                    self.game.board.get_piece_at(row, col) is None):
-                    valid_moves.append(('place_pawn', row, col))
+        for row, col in iter_squares(self.game.board.pawn_placement_mask(color)):
+            valid_moves.append(('place_pawn', row, col))
 
         # Find all pawns that can be upgraded and their upgrade options
-        for row in range(8):
-            for col in range(8):
-                piece = self.game.board.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.PAWN and piece.color == color:
-                    valid_moves.append(('upgrade_pawn', row, col, PieceType.FARM))
-                    valid_moves.append(('upgrade_pawn', row, col, PieceType.TURRET))
-                    valid_moves.append(('upgrade_pawn', row, col, PieceType.SHIELD))
+        for row, col in iter_squares(self.game.board.bitboards[color][PieceType.PAWN]):
+            valid_moves.append(('upgrade_pawn', row, col, PieceType.FARM))
+            valid_moves.append(('upgrade_pawn', row, col, PieceType.TURRET))
+            valid_moves.append(('upgrade_pawn', row, col, PieceType.SHIELD))
 
         # Find all valid turret firing targets
-        for row in range(8):
-            for col in range(8):
-                piece = self.game.board.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.TURRET and piece.color == color:
-                    valid_targets = self.game.find_valid_targets_for_turret(row, col)
-                    for target_row, target_col in valid_targets:
-                        valid_moves.append(('fire_turret', row, col, target_row, target_col))
+        for (row, col), valid_targets in self.game.find_all_turret_targets(color).items():
+            for target_row, target_col in valid_targets:
+                valid_moves.append(('fire_turret', row, col, target_row, target_col))
 
         return valid_moves
 
@@ -134,20 +150,20 @@ class SimpleAI(Game):
             return False 
 
         color = self.get_current_color()
-        valid_moves = self.find_valid_moves()
-        for move in valid_moves:
-            if move[0] == 'fire_turret':
-                target_row, target_col = move[3], move[4]
+        attack_map = self.game.find_all_turret_targets(color)
+        for (turret_row, turret_col), valid_targets in attack_map.items():
+            for target_row, target_col in valid_targets:
+                move = ('fire_turret', turret_row, turret_col, target_row, target_col)
                 target_piece = self.game.board.get_piece_at(target_row, target_col)
                 if target_piece and target_piece.piece_type == PieceType.KING:
-                    self.game.valid_targets = self.game.find_valid_targets_for_turret(move[1], move[2])
+                    self.game.valid_targets = valid_targets
                     self.game.fire_turret(move[1], move[2], target_row, target_col)
                     self.data_collector.log_data(
-                        self.data_collector.serialize_game_state(self.game),
+                        self.data_collector.snapshot_game_state(self.game),
                         self.data_collector.serialize_action('fire_turret', {'from': (move[1], move[2]), 'to': (target_row, target_col)}),
                         'win'
                     )
-                    print(f"{self.player_name} fires turret from {(move[1], move[2])} to {(target_row, target_col)}")
+                    move_message(f"{self.player_name} fires turret from {(move[1], move[2])} to {(target_row, target_col)}")
                     self.game.game_over = True
                     self.game.winner = self.player_name
                     return True 
@@ -164,30 +180,30 @@ class SimpleAI(Game):
             if move[0] == 'place_pawn':
                 self.game.board.place_piece(move[1], move[2], PieceType.PAWN, color)
                 self.data_collector.log_data(
-                    self.data_collector.serialize_game_state(self.game),
+                    self.data_collector.snapshot_game_state(self.game),
                     self.data_collector.serialize_action('place_pawn', {'row': move[1], 'col': move[2]}),
                     'in_progress'
                 )
-                print(f"{self.player_name} places pawn at {(move[1], move[2])}")
+                move_message(f"{self.player_name} places pawn at {(move[1], move[2])}")
                 self.game.actions[color] -= 1
             elif move[0] == 'upgrade_pawn':
-                self.game.board.board[move[1]][move[2]] = Piece(color, move[3])
+                self.game.board.set_piece_at(move[1], move[2], Piece(color, move[3]))
                 self.data_collector.log_data(
-                    self.data_collector.serialize_game_state(self.game),
+                    self.data_collector.snapshot_game_state(self.game),
                     self.data_collector.serialize_action('upgrade_pawn', {'row': move[1], 'col': move[2], 'to': move[3].name}),
                     'in_progress'
                 )
-                print(f"{self.player_name} upgrades pawn at {(move[1], move[2])} to {move[3].name}")
+                move_message(f"{self.player_name} upgrades pawn at {(move[1], move[2])} to {move[3].name}")
                 self.game.actions[color] -= 1
             elif move[0] == 'fire_turret':
                 self.game.valid_targets = self.game.find_valid_targets_for_turret(move[1], move[2])
                 self.game.fire_turret(move[1], move[2], move[3], move[4])
                 self.data_collector.log_data(
-                    self.data_collector.serialize_game_state(self.game),
+                    self.data_collector.snapshot_game_state(self.game),
                     self.data_collector.serialize_action('fire_turret', {'from': (move[1], move[2]), 'to': (move[3], move[4])}),
                     'in_progress'
                 )
-                print(f"{self.player_name} fires turret from {(move[1], move[2])} to {(move[3], move[4])}")
+                move_message(f"{self.player_name} fires turret from {(move[1], move[2])} to {(move[3], move[4])}")
                 self.game.actions[color] -= 1
             return True
         return False
@@ -202,7 +218,7 @@ class SimpleAI(Game):
     def end_game_with_loss(self):
         winner = "Player 1" if self.player_name == "Player 2" else "Player 2"
         self.data_collector.log_data(
-            self.data_collector.serialize_game_state(self.game),
+            self.data_collector.snapshot_game_state(self.game),
             {'action': 'game_over', 'winner': winner},
             'loss'
         )
@@ -0,0 +1,114 @@
+import hashlib
+from ai_game.ai_pieces import PieceType
+
+'''Packs a game state into one int so Q-table keys compare by value
+
+Bits 0-255 hold the board, four bits per square (square n is bits 4n to
+4n+3, see PIECE_CODES). Above that sit the turn and the two players'
+actions and action points, eight bits each.'''
+
+PIECE_TYPES = (PieceType.KING, PieceType.FARM, PieceType.PAWN, PieceType.TURRET, PieceType.SHIELD)
+PIECE_CODES = {}
+for index, piece_type in enumerate(PIECE_TYPES):
+    PIECE_CODES[("white", piece_type)] = index + 1
+    PIECE_CODES[("black", piece_type)] = index + 6
+CODE_PIECES = {code: color_and_type for color_and_type, code in PIECE_CODES.items()}
+
+TURNS = ("white_king", "white_farm", "black_king", "black_farm", "white", "black")
+TURN_INDEXES = {turn: index for index, turn in enumerate(TURNS)}
+
+BOARD_BITS = 256
+BOARD_MASK = (1 << BOARD_BITS) - 1
+KEY_BYTES = 40  # Enough for any packed state, for fixed width storage
+
+
+def _counter(value):
+    return min(max(value, 0), 255)
+
+
+def encode_state(game):
+    """The game state as one int, equal for equal positions in any game"""
+    return (game.board.packed
+            | TURN_INDEXES[game.turn] << BOARD_BITS
+            | _counter(game.actions["white"]) << (BOARD_BITS + 3)
+            | _counter(game.actions["black"]) << (BOARD_BITS + 11)
+            | _counter(game.action_points["white"]) << (BOARD_BITS + 19)
+            | _counter(game.action_points["black"]) << (BOARD_BITS + 27))
+
+
+def decode_state(state):
+    """Splits a state key back into (square codes, turn, actions, action points)"""
+    codes = [(state >> (4 * square)) & 0xF for square in range(64)]
+    turn = TURNS[(state >> BOARD_BITS) & 0x7]
+    actions = {"white": (state >> (BOARD_BITS + 3)) & 0xFF, "black": (state >> (BOARD_BITS + 11)) & 0xFF}
+    action_points = {"white": (state >> (BOARD_BITS + 19)) & 0xFF, "black": (state >> (BOARD_BITS + 27)) & 0xFF}
+    return codes, turn, actions, action_points
+
+
+def state_fingerprint(state):
+    """64-bit fingerprint of a packed state, never 0"""
+    digest = hashlib.blake2b(state.to_bytes(KEY_BYTES, 'little'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def _legacy_board(state):
+    """Packs an old tuple-of-rows-of-Pieces state, returns None if it isn't one"""
+    if not isinstance(state, tuple) or len(state) != 8:
+        return None
+    packed = 0
+    for row, pieces in enumerate(state):
+        for col, piece in enumerate(pieces):
+            if piece is not None:
+                packed |= PIECE_CODES[(piece.color, piece.piece_type)] << (4 * (row * 8 + col))
+    return packed
+
+
+def _legacy_mover(packed, action):
+    """Works out whose turn it was from the piece the action used"""
+    row, col = action[1], action[2]
+    code = (packed >> (4 * (row * 8 + col))) & 0xF
+    if code:
+        return CODE_PIECES[code][0]
+    # A pawn placement, so look at who owns the neighbouring squares
+    owners = set()
+    for adj_row, adj_col in [(row-1, col), (row+1, col), (row, col-1), (row, col+1)]:
+        if 0 <= adj_row < 8 and 0 <= adj_col < 8:
+            adj_code = (packed >> (4 * (adj_row * 8 + adj_col))) & 0xF
+            if adj_code:
+                owners.add(CODE_PIECES[adj_code][0])
+    return owners.pop() if len(owners) == 1 else None
+
+
+def is_legacy_q_table(q_table):
+    for state, action in q_table:
+        return isinstance(state, tuple)
+    return False
+
+
+def migrate_q_table(q_table):
+    """Converts a Q-table keyed by tuples of Piece objects to packed state keys
+
+    Old tables only stored the board, so the turn comes from the piece the
+    action used and the counters are set to one action and no action points,
+    which is what the agent holds for the first action of most turns.
+    Entries with no action or an unknown mover are dropped and entries that
+    end up on the same key are averaged.
+    """
+    migrated = {}
+    merged = {}
+    for (state, action), q_value in q_table.items():
+        packed = _legacy_board(state)
+        if packed is None or not action:
+            continue
+        mover = _legacy_mover(packed, action)
+        if mover is None:
+            continue
+        key = (packed
+               | TURN_INDEXES[mover] << BOARD_BITS
+               | 1 << (BOARD_BITS + 3 if mover == "white" else BOARD_BITS + 11), action)
+        if key in migrated:
+            merged[key] = merged.get(key, 1) + 1
+            migrated[key] += (q_value - migrated[key]) / merged[key]
+        else:
+            migrated[key] = q_value
+    return migrated
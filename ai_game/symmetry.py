@@ -0,0 +1,115 @@
+from functools import lru_cache
+import numpy as np
+
+from ai_game.state_encoding import BOARD_BITS, BOARD_MASK
+from ai_game.q_table import ACTION_COUNT, FIRE_OFFSET, NO_ACTION, UPGRADE_OFFSET, new_q_table, table_storage
+
+'''The 8 rotations and reflections of the board
+
+Nothing in the rules cares about orientation (the center squares kings
+can't start on are symmetric too), so a position and its mirror images
+share Q-values. Transform 0 is the identity.'''
+
+TRANSFORMS = [
+    lambda row, col: (row, col),          # identity
+    lambda row, col: (col, 7 - row),      # rotate 90
+    lambda row, col: (7 - row, 7 - col),  # rotate 180
+    lambda row, col: (7 - col, row),      # rotate 270
+    lambda row, col: (row, 7 - col),      # mirror left/right
+    lambda row, col: (7 - row, col),      # mirror top/bottom
+    lambda row, col: (col, row),          # main diagonal
+    lambda row, col: (7 - col, 7 - row),  # anti diagonal
+]
+
+# SQUARE_MAPS[transform][square] is where that square ends up, SHIFT_MAPS is the same in packed bit offsets
+SQUARE_MAPS = [[row * 8 + col for row, col in (transform(*divmod(square, 8)) for square in range(64))]
+               for transform in TRANSFORMS]
+SHIFT_MAPS = [[4 * square for square in square_map] for square_map in SQUARE_MAPS]
+
+
+def _action_id_map(transform):
+    square_map = SQUARE_MAPS[transform]
+    mapped = np.arange(ACTION_COUNT)
+    for square in range(64):
+        mapped[square] = square_map[square]
+        for upgrade in range(3):
+            mapped[UPGRADE_OFFSET + square * 3 + upgrade] = UPGRADE_OFFSET + square_map[square] * 3 + upgrade
+        row, col = divmod(square, 8)
+        for direction, (row_step, col_step) in enumerate([(-1, -1), (-1, 1), (1, -1), (1, 1)]):
+            # The transforms are affine so they work on off-board squares too, which gives the new diagonal
+            new_row, new_col = TRANSFORMS[transform](row, col)
+            step_row, step_col = TRANSFORMS[transform](row + row_step, col + col_step)
+            new_direction = (2 if step_row > new_row else 0) + (1 if step_col > new_col else 0)
+            mapped[FIRE_OFFSET + square * 4 + direction] = FIRE_OFFSET + square_map[square] * 4 + new_direction
+    mapped[NO_ACTION] = NO_ACTION
+    return mapped
+
+
+# ACTION_ID_MAPS[transform][action id] is the id of the same action on the transformed board
+ACTION_ID_MAPS = np.array([_action_id_map(transform) for transform in range(len(TRANSFORMS))])
+
+
+def _board_pieces(packed):
+    """(square, code) for every occupied square of a packed board"""
+    pieces = []
+    for index, byte in enumerate(packed.to_bytes(BOARD_BITS // 8, 'little')):
+        if byte:
+            if byte & 0xF:
+                pieces.append((2 * index, byte & 0xF))
+            if byte >> 4:
+                pieces.append((2 * index + 1, byte >> 4))
+    return pieces
+
+
+def transform_board(packed, transform):
+    shift_map = SHIFT_MAPS[transform]
+    result = 0
+    for square, code in _board_pieces(packed):
+        result |= code << shift_map[square]
+    return result
+
+
+@lru_cache(maxsize=65536)
+def canonicalize_state(state):
+    """Smallest image of a packed state under the 8 symmetries, and the transform that gives it"""
+    context = state >> BOARD_BITS << BOARD_BITS
+    pieces = _board_pieces(state & BOARD_MASK)
+
+    best_board = None
+    best_transform = 0
+    for transform, shift_map in enumerate(SHIFT_MAPS):
+        image = 0
+        for square, code in pieces:
+            image |= code << shift_map[square]
+        if best_board is None or image < best_board:
+            best_board = image
+            best_transform = transform
+    return context | best_board, best_transform
+
+
+def transform_action(action, transform):
+    """Moves the squares in an action tuple the same way as the board"""
+    if action is None or transform == 0 or len(action) < 3:
+        return action
+    move = TRANSFORMS[transform]
+    if action[0] == 'fire_turret':
+        return (action[0],) + move(action[1], action[2]) + move(action[3], action[4])
+    return (action[0],) + move(action[1], action[2]) + tuple(action[3:])
+
+
+def canonicalize_q_table(q_table):
+    """Copy of a table keyed by raw states re-keyed by symmetry class
+
+    Each entry moves to the canonical state with its action id mapped the
+    same way, entries that land on the same key are averaged.
+    """
+    totals = {}
+    for (state, action_id), value in q_table.items():
+        canonical_state, transform = canonicalize_state(state)
+        key = (canonical_state, int(ACTION_ID_MAPS[transform][action_id]))
+        total, count = totals.get(key, (0.0, 0))
+        totals[key] = (total + value, count + 1)
+    canonical = new_q_table(table_storage(q_table), max(1024, len(q_table)), getattr(q_table, 'max_states', None))
+    for (state, action_id), (total, count) in totals.items():
+        canonical.set(state, action_id, total / count)
+    return canonical
@@ -0,0 +1,42 @@
+import random
+from ai_game.ai_pieces import PieceType
+
+'''Zobrist keys for Territory positions
+
+Fixed seed so a hash means the same position in every run.'''
+
+_generator = random.Random(0x7E77170)
+
+PIECE_KEYS = {
+    color: {piece_type: [_generator.getrandbits(64) for square in range(64)] for piece_type in PieceType}
+    for color in ("white", "black")
+}
+TURN_KEYS = {turn: _generator.getrandbits(64) for turn in ("white_king", "white_farm", "black_king", "black_farm", "white", "black")}
+
+# Actions and action points have no hard cap, so values past the end of these tables get mixed on the fly
+ACTION_KEYS = {color: [_generator.getrandbits(64) for num in range(32)] for color in ("white", "black")}
+ACTION_POINT_KEYS = {color: [_generator.getrandbits(64) for num in range(128)] for color in ("white", "black")}
+
+
+def _mix(value):
+    """splitmix64 finaliser, spreads a counter value over all 64 bits"""
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+def counter_key(keys, value):
+    if 0 <= value < len(keys):
+        return keys[value]
+    return _mix(keys[0] ^ (value & 0xFFFFFFFF))
+
+
+def game_hash(game):
+    """Hash of the whole game state: pieces, whose turn it is, actions and action points"""
+    return (game.board.zobrist
+            ^ TURN_KEYS[game.turn]
+            ^ counter_key(ACTION_KEYS["white"], game.actions["white"])
+            ^ counter_key(ACTION_KEYS["black"], game.actions["black"])
+            ^ counter_key(ACTION_POINT_KEYS["white"], game.action_points["white"])
+            ^ counter_key(ACTION_POINT_KEYS["black"], game.action_points["black"]))
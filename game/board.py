@@ -1,9 +1,13 @@
 from .pieces import Piece, PieceType
 
+PIECE_TYPES = (PieceType.KING, PieceType.FARM, PieceType.PAWN, PieceType.TURRET, PieceType.SHIELD)
+
 class Board:
     def __init__(self):
         self.board = [[None for num in range(8)] for num in range(8)]
         self.king_positions = {"white": None, "black": None}
+        # Live index of where each color's pieces are, kept in sync by set_piece_at/remove_piece
+        self.piece_squares = {color: {piece_type: set() for piece_type in PIECE_TYPES} for color in ("white", "black")}
 
     def get_piece_at(self, row, col):
         if 0 <= row < 8 and 0 <= col < 8:
@@ -11,13 +15,40 @@ class Board:
         else:
             return None
 
+    def set_piece_at(self, row, col, piece):
+        """Puts a piece (or None) on a square, replacing whatever was there"""
+        self.remove_piece(row, col)
+        if piece is None:
+            return
+        self.board[row][col] = piece
+        piece.position = (row, col)
+        self.piece_squares[piece.color][piece.piece_type].add((row, col))
+        if piece.piece_type == PieceType.KING:
+            self.king_positions[piece.color] = (row, col)
+
+    def remove_piece(self, row, col):
+        """Clears a square and returns the piece that was on it"""
+        piece = self.board[row][col]
+        if piece is None:
+            return None
+        self.board[row][col] = None
+        self.piece_squares[piece.color][piece.piece_type].discard((row, col))
+        if piece.piece_type == PieceType.KING:
+            self.king_positions[piece.color] = None
+        return piece
+
+    def piece_positions(self, color, piece_type=None):
+        """Squares holding the player's pieces, optionally only one type"""
+        if piece_type is not None:
+            return list(self.piece_squares[color][piece_type])
+        positions = []
+        for squares in self.piece_squares[color].values():
+            positions.extend(squares)
+        return positions
+
     def place_piece(self, row, col, piece_type, color):
         if self.is_valid_position(row, col) and self.board[row][col] is None:
-            newpiece = Piece(color, piece_type)
-            self.board[row][col] = newpiece
-            newpiece.position = (row, col)
-            if piece_type == PieceType.KING:
-                self.king_positions[color] = (row, col)
+            self.set_piece_at(row, col, Piece(color, piece_type))
             return True
         return False
 
@@ -57,39 +88,16 @@ class Board:
 
     def has_pawn(self, color):
         """Checks if the player has a pawn."""
-        for row in range(8):
-            for col in range(8):
-                piecetest = self.get_piece_at(row, col)
-                if piecetest and piecetest.piece_type == PieceType.PAWN and piecetest.color == color:
-                    return True
-        return False
+        return len(self.piece_squares[color][PieceType.PAWN]) > 0
 
     def has_turret(self, color):
         """Checks if the player has a turret."""
-        for row in range(8):
-            for col in range(8):
-                piecetest = self.get_piece_at(row, col)
-                if piecetest and piecetest.piece_type == PieceType.TURRET and piecetest.color == color:
-                    return True
-        return False
-
+        return len(self.piece_squares[color][PieceType.TURRET]) > 0
 
     def count_farms(self, color):
         """Counts the number of farms a player has"""
-        farm_count = 0
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.FARM and piece.color == color:
-                    farm_count += 1
-        return farm_count
-
+        return len(self.piece_squares[color][PieceType.FARM])
 
     def find_king(self, color):
         """Stores the kings position for future reference"""
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece_at(row, col)
-                if piece and piece.piece_type == PieceType.KING and piece.color == color:
-                    return row, col
-        return None
+        return self.king_positions[color]
@@ -1,3 +1,4 @@
+from collections import deque
 from .board import Board
 from .pieces import Piece, PieceType
 
@@ -118,7 +119,7 @@ class Game:
         current_color = "white" if self.turn.lower() == "white" else "black"
         piece_type = getattr(PieceType, new_type.upper(), None)
         if piece_type:
-            self.board.board[row][col] = Piece(current_color, piece_type)
+            self.board.set_piece_at(row, col, Piece(current_color, piece_type))
             self.actions[current_color] -= 1
             self.upgrade_mode = False
             self.selected_pawn = None
@@ -176,20 +177,19 @@ class Game:
 
     def get_connected_pieces(self, start_row, start_col):
         """Uses BFS to find all connected pieces to the king"""
-        visited = set()
-        mylist = [(start_row, start_col)]
+        color = self.board.get_piece_at(start_row, start_col).color
+        visited = {(start_row, start_col)}
+        mylist = deque([(start_row, start_col)])
         directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]  # Only horizontal and vertical directions count, no diagonals
 
         while mylist:
-            row, col = mylist.pop(0)
-            if (row, col) in visited:
-                continue
-            visited.add((row, col))
+            row, col = mylist.popleft()
             for dr, dc in directions:
                 new_row, new_col = row + dr, col + dc
-                if 0 <= new_row < 8 and 0 <= new_col < 8:
+                if (new_row, new_col) not in visited and 0 <= new_row < 8 and 0 <= new_col < 8:
                     piece = self.board.get_piece_at(new_row, new_col)
-                    if piece and piece.color == self.board.get_piece_at(start_row, start_col).color:
+                    if piece and piece.color == color:
+                        visited.add((new_row, new_col))
                         mylist.append((new_row, new_col))
         return visited
 
@@ -199,12 +199,10 @@ class Game:
             king_position = self.board.find_king(color)
             connected_pieces = self.get_connected_pieces(*king_position)
             piececount = 0
-            for row in range(8):
-                for col in range(8):
-                    piece = self.board.get_piece_at(row, col)
-                    if piece and piece.color == color and (row, col) not in connected_pieces:
-                        self.board.board[row][col] = None
-                        piececount+= 1
+            for row, col in self.board.piece_positions(color):
+                if (row, col) not in connected_pieces:
+                    self.board.remove_piece(row, col)
+                    piececount+= 1
             if piececount > 0:
                 if piececount == 1:
                     print('1 isolated piece lost :(')
@@ -217,17 +215,17 @@ class Game:
             target_piece = self.board.get_piece_at(target_row, target_col)
             if target_piece:
                 if target_piece.piece_type == PieceType.SHIELD:   #Converts shields into pawns
-                    self.board.board[target_row][target_col] = Piece(target_piece.color, PieceType.PAWN)
+                    self.board.set_piece_at(target_row, target_col, Piece(target_piece.color, PieceType.PAWN))
                     print(f"Turret at ({turret_row}, {turret_col}) hit a shield at ({target_row}, {target_col}).")
                 elif target_piece.piece_type == PieceType.KING:   #If it hits the king, game over
-                    self.board.board[target_row][target_col] = None
+                    self.board.remove_piece(target_row, target_col)
                     self.game_over = True
                     self.winner = "Player 2" if target_piece.color == self.player1_color else "Player 1"
                     self.scores[self.winner] += 1 
                     print(f"Game over! {self.winner} wins!")
 
                 else: 
-                    self.board.board[target_row][target_col] = None   #removes the piece
+                    self.board.remove_piece(target_row, target_col)   #removes the piece
                     print(f"Turret at ({turret_row}, {turret_col}) fired and removed {target_piece.color} {target_piece.piece_type} at ({target_row}, {target_col}).")
                 
                 self.selected_turret = None
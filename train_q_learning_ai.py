@@ -1,61 +1,212 @@
-import pickle
+import os
+import random
+import multiprocessing
+import numpy as np
 from ai_game.ai_logic import Game
 from ai_game.q_learning_ai import QLearningAI
 from ai_game.data_collection import DataCollector
+from ai_game.log_levels import set_log_level
+from ai_game import q_table as q_table_store
+from ai_game.shared_q_table import SharedQTable
+from ai_game.q_checkpoint import QTableCheckpointer
+from ai_game.offline_training import load_transitions, train_offline
+from ai_game.replay_buffer import ReplayBuffer
 
 def save_q_table(q_table, file_name='qtable/q_table.pkl'):
-    with open(file_name, 'wb') as file:
-        pickle.dump(q_table, file)
+    q_table_store.save_q_table(q_table, file_name)
     print("Q-table saved.")
 
-def load_q_table(file_name='qtable/q_table.pkl'):
-    try:
-        with open(file_name, 'rb') as file:
-            q_table = pickle.load(file)
-        print("Q-table loaded.")
-        return q_table
-    except FileNotFoundError:
+def load_q_table(file_name='qtable/q_table.pkl', storage=None, canonical=True, memory_limit_mb=None):
+    if not os.path.exists(file_name):
         print("Q-table file not found. Starting with an empty Q-table.")
-        return {}
+    memory_limit = memory_limit_mb * 2 ** 20 if memory_limit_mb else None
+    q_table = q_table_store.load_q_table(file_name, storage=storage, canonical=canonical, memory_limit=memory_limit)
+    print("Q-table loaded.")
+    return q_table
+
+def play_episode(q_table, episode, episodes, max_turns=100, data_file='game_data.csv', replay=None):
+    """Plays one self-play game, both players learning into the same Q-table"""
+    print(f"Starting episode {episode + 1}/{episodes}")
+    game = Game()
+    ai_player1 = QLearningAI(game, player_name="Player 1", episode=episode + 1, replay=replay)
+    ai_player2 = QLearningAI(game, player_name="Player 2", episode=episode + 1, replay=replay)
+    if data_file != 'game_data.csv':
+        ai_player1.data_collector = DataCollector.shared(data_file)
+        ai_player2.data_collector = ai_player1.data_collector
+    
+    ai_player1.q_table = q_table
+    ai_player2.q_table = q_table
+    q_table.start_episode()
+    
+    game_over = False
+    turn_count = 0
+
+    while not game_over and turn_count < max_turns:
+        #Main game loop
+        turn_count += 1
+        ai_player1.make_move()
+        if game.game_over:
+            game_over = True
+            break
+
+        ai_player2.make_move()
+        if game.game_over:
+            game_over = True
+            break
 
-def train_q_learning_ai(episodes=50, max_turns=100):
-    q_table = load_q_table()
+    # Epsilon decay for q learning and decision making
+    ai_player1.epsilon = max(ai_player1.min_epsilon, ai_player1.epsilon * ai_player1.epsilon_decay)
+    ai_player2.epsilon = max(ai_player2.min_epsilon, ai_player2.epsilon * ai_player2.epsilon_decay)
+    
+    ai_player1.data_collector.log_episode_summary(episode + 1, game.winner, turn_count)
+    print(f"Episode {episode + 1}/{episodes} completed in {turn_count} turns\n")
+    return turn_count
+
+def train_q_learning_ai(episodes=50, max_turns=100, checkpoint_interval=5.0, memory_limit_mb=None, q_storage=None,
+                        data_file='game_data.csv', log_level=None, replay_size=None):
+    """Self-play on one process, appending changed rows to the Q-table's delta log every checkpoint_interval seconds
+
+    With memory_limit_mb set the Q-table evicts its least useful states
+    instead of growing past that size. q_storage='int16' (or 'float16')
+    converts the table to 16 bit Q-values, see ai_game.q_table.QuantizedQTable.
+    A data_file ending in .bin gets the binary log of ai_game.game_records.
+    log_level is one of ai_game.log_levels.LEVELS, 'summary' only writes a
+    row per episode to <data_file>_summary.csv. With replay_size set both
+    players learn from minibatches of a replay buffer holding that many of
+    the latest moves, see ai_game.replay_buffer.
+    """
+    if log_level:
+        set_log_level(log_level)
+    replay = ReplayBuffer(replay_size) if replay_size else None
+    q_table = load_q_table(storage=q_storage, memory_limit_mb=memory_limit_mb)
+    checkpointer = QTableCheckpointer(q_table, interval=checkpoint_interval)
     
     for episode in range(episodes):
-        print(f"Starting episode {episode + 1}/{episodes}")
-        data_collector = DataCollector()
-        game = Game()
-        ai_player1 = QLearningAI(game, player_name="Player 1", episode=episode + 1)
-        ai_player2 = QLearningAI(game, player_name="Player 2", episode=episode + 1)
-        
-        ai_player1.q_table = q_table
-        ai_player2.q_table = q_table
-        
-        game_over = False
-        turn_count = 0
-        state_history = set()
-
-        while not game_over and turn_count < max_turns:
-            #Main game loop
-            turn_count += 1
-            current_state = ai_player1.get_state()
-            ai_player1.make_move()
-            if game.game_over:
-                game_over = True
-                break
-
-            ai_player2.make_move()
-            if game.game_over:
-                game_over = True
-                break
-
-        # Epsilon decay for q learning and decision making
-        ai_player1.epsilon = max(ai_player1.min_epsilon, ai_player1.epsilon * ai_player1.epsilon_decay)
-        ai_player2.epsilon = max(ai_player2.min_epsilon, ai_player2.epsilon * ai_player2.epsilon_decay)
-        
-        print(f"Episode {episode + 1}/{episodes} completed in {turn_count} turns\n")
-
-    save_q_table(ai_player1.q_table) # WE NEED THIS LINE TO SAVE THE Q TABLE
+        play_episode(q_table, episode, episodes, max_turns, data_file, replay)
+        checkpointer.maybe_checkpoint()
+
+    checkpointer.close() # WE NEED THIS LINE TO SAVE THE Q TABLE
+    print(f"Q-table saved. {q_table.stats()}")
+
+def _self_play_worker(task):
+    q_table, first_episode, episode_count, episodes, max_turns, seed, data_file, log_level = task
+    if log_level:
+        set_log_level(log_level)
+    random.seed(seed)
+    np.random.seed(seed)
+    q_table.track_changes()
+    for episode in range(first_episode, first_episode + episode_count):
+        play_episode(q_table, episode, episodes, max_turns, data_file)
+    DataCollector.shared(data_file).flush()  # Pool workers get killed without running atexit
+    return q_table.take_changes()
+
+_shared_q_table = None
+_worker_index = None
+
+def _init_shared_worker(q_table, worker_counter):
+    global _shared_q_table, _worker_index
+    _shared_q_table = q_table
+    # Tasks land on whichever process is free, so the log file goes with the process rather than the task
+    with worker_counter.get_lock():
+        _worker_index = worker_counter.value
+        worker_counter.value += 1
+
+def _shared_self_play_worker(task):
+    first_episode, episode_count, episodes, max_turns, seed, log_format, log_level = task
+    data_file = f"game_data_worker{_worker_index}.{log_format}"
+    if log_level:
+        set_log_level(log_level)
+    random.seed(seed)
+    np.random.seed(seed)
+    for episode in range(first_episode, first_episode + episode_count):
+        play_episode(_shared_q_table, episode, episodes, max_turns, data_file)
+    DataCollector.shared(data_file).flush()
+    return episode_count
+
+def train_q_learning_ai_parallel(episodes=1000, workers=None, sync_interval=25, max_turns=100, seed=None, shared_capacity=None,
+                                 memory_limit_mb=None, q_storage=None, log_format='csv', log_level=None):
+    """Self-play on several processes at once
+
+    Every round each worker gets a copy of the master Q-table, plays
+    sync_interval episodes with its own seed and sends back how far it moved
+    each entry. Entries more than one worker changed get the average of
+    their changes. Worker n logs to game_data_worker<n>.csv so the CSV rows
+    don't interleave, or to game_data_worker<n>.bin with log_format='bin'.
+
+    With shared_capacity set (a power of two) the workers instead all learn
+    straight into one SharedQTable that holds up to that many states, so
+    nothing gets copied or merged and sync_interval only sets how often
+    progress gets printed.
+
+    memory_limit_mb bounds the master table and every worker's copy, it
+    doesn't apply to the shared table. q_storage and log_level work as in
+    train_q_learning_ai.
+    """
+    workers = workers or os.cpu_count()
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    q_table = load_q_table(storage=q_storage, memory_limit_mb=None if shared_capacity else memory_limit_mb)
+    if shared_capacity:
+        _train_shared(q_table, episodes, workers, sync_interval, max_turns, seed, shared_capacity, log_format, log_level)
+        return
+    checkpointer = QTableCheckpointer(q_table)
+    next_episode = 0
+    sync_round = 0
+
+    with multiprocessing.Pool(workers) as pool:
+        while next_episode < episodes:
+            tasks = []
+            for worker in range(workers):
+                episode_count = min(sync_interval, episodes - next_episode)
+                if episode_count <= 0:
+                    break
+                worker_seed = (seed + sync_round * workers + worker) % 2 ** 32
+                tasks.append((q_table, next_episode, episode_count, episodes, max_turns, worker_seed, f"game_data_worker{worker}.{log_format}", log_level))
+                next_episode += episode_count
+            q_table.apply_changes(pool.map(_self_play_worker, tasks))
+            sync_round += 1
+            print(f"Synced after {next_episode}/{episodes} episodes, Q-table has {len(q_table)} states")
+            checkpointer.maybe_checkpoint()
+
+    checkpointer.close()
+    print(f"Q-table saved. {q_table.stats()}")
+
+def _train_shared(q_table, episodes, workers, sync_interval, max_turns, seed, capacity, log_format, log_level):
+    shared_q_table = SharedQTable.from_q_table(q_table, capacity)
+    try:
+        worker_counter = multiprocessing.Value('i', 0)
+        with multiprocessing.Pool(workers, initializer=_init_shared_worker, initargs=(shared_q_table, worker_counter)) as pool:
+            tasks = []
+            for task_number, first_episode in enumerate(range(0, episodes, sync_interval)):
+                episode_count = min(sync_interval, episodes - first_episode)
+                tasks.append((first_episode, episode_count, episodes, max_turns, (seed + task_number) % 2 ** 32, log_format, log_level))
+            finished = 0
+            for episode_count in pool.imap_unordered(_shared_self_play_worker, tasks):
+                finished += episode_count
+                print(f"{finished}/{episodes} episodes done, Q-table has {len(shared_q_table)} states")
+        storage = q_table_store.table_storage(q_table)
+        save_q_table(q_table_store.convert_storage(shared_q_table.to_q_table(), storage) if storage != 'float32' else shared_q_table.to_q_table())
+    finally:
+        shared_q_table.close()
+
+def train_q_learning_ai_offline(log_files, sweeps=10, alpha=0.1, gamma=0.9, batch_size=65536, use_symmetry=True, q_storage=None, seed=None,
+                                shuffle=True):
+    """Learns from .bin logs of earlier training runs instead of playing new games
+
+    Every QLearningAI update in the logs is run again sweeps times with
+    this alpha and gamma, see ai_game.offline_training.
+    """
+    transitions = load_transitions(log_files, use_symmetry)
+    print(f"Loaded {len(transitions.rewards)} transitions over {len(transitions.states)} states")
+    q_table = load_q_table(storage=q_storage, canonical=use_symmetry)
+    if not use_symmetry:
+        q_table.canonical = False
+    changes = train_offline(q_table, transitions, alpha, gamma, sweeps, batch_size, seed, shuffle)
+    for sweep, change in enumerate(changes):
+        print(f"Sweep {sweep + 1}/{sweeps}: mean |change in Q| {change:.4f}")
+    save_q_table(q_table)
 
 if __name__ == "__main__":
+    # For long runs use train_q_learning_ai_parallel(episodes=10000, workers=32) instead,
+    # memory_limit_mb=... on either keeps the Q-table from growing past that size
     train_q_learning_ai(episodes=50)  # Adjust number of episodes as needed --- NUMBERS > 1000 WILL TAKE A WHILE, ANYTHING MORE THAN 10k WILL MAKE THE Q TABLE FILE HUGE AND SLOW
\ No newline at end of file